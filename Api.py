@@ -0,0 +1,237 @@
+# Important libraries
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from flask import Response, g, jsonify, request
+
+from Inference import record_columns
+from Metrics import METRICS, Counter, current_trace_id, end_trace, new_trace_id
+from Training import MODEL_PARAMS
+
+
+# JSON values a record field may hold
+SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class MicroBatcher:
+    """Combine concurrent prediction requests into a single predict call
+    - Requests queue their records; one thread takes everything queued,
+      scores it in one call and hands every request its rows back
+    - A lone request is scored straight away, requests arriving while a
+      batch is scored are combined into the next batch
+
+    Parameters:
+        predict: callable
+            -> function scoring a list of records, returns an array
+        max_batch: int
+            -> maximum rows per predict call
+        max_wait: float
+            -> seconds to wait for more requests before scoring, 0 only
+               combines requests that are already queued
+    """
+    def __init__(self, predict, max_batch=512, max_wait=0.0):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, records, timeout=30):
+        """Predictions for the records, scored with other queued requests"""
+        future = Future()
+        self._queue.put((records, future))
+        return future.result(timeout=timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        rows = len(batch[0][0])
+        while rows < self.max_batch:
+            try:
+                item = self._queue.get(timeout=self.max_wait) if self.max_wait else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _score_alone(self, records, future):
+        try:
+            future.set_result(np.asarray(self.predict(records)))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                pred = np.asarray(self.predict([record for records, future in batch for record in records]))
+            except Exception:
+                if len(batch) == 1:
+                    self._score_alone(*batch[0])
+                    continue
+                # score the requests one by one, only the bad one fails
+                logging.warning(f"Batch prediction of {len(batch)} requests failed, scoring them one by one")
+                for records, future in batch:
+                    self._score_alone(records, future)
+                continue
+            splits = np.cumsum([len(records) for records, future in batch])[:-1]
+            for (records, future), rows in zip(batch, np.split(pred, splits)):
+                future.set_result(rows)
+
+
+def register_api(server, registry):
+    """Add the `/predict` JSON endpoint to the Flask server
+    Request body, one of:
+        {"model": "forest", "records": [{...}, {...}]}
+        {"model": "forest", "record": {...}}
+        [{...}, {...}] or {...}   (linear model)
+    Response:
+        {"model": "forest", "predictions": [{"Id": 1461, "SalePrice": 120000.0}]}
+
+    Parameters:
+        server: flask.Flask
+            -> the server behind the Dash app
+        registry: ModelRegistry
+            -> where the preloaded (compiled) pipelines and feature
+               transformer live
+    """
+    batchers = {}
+    lock = threading.Lock()
+
+    def predictor(model_type):
+        """Score records with the compiled pipeline, no pandas involved"""
+        def predict(records):
+            transformer = registry.feature_transformer()
+            data = transformer.transform_columns(record_columns(records, transformer.selected_columns_))
+            return registry.compiled_model(model_type).predict(data)
+        return predict
+
+    def get_batcher(model_type):
+        with lock:
+            if model_type not in batchers:
+                batchers[model_type] = MicroBatcher(predictor(model_type))
+            return batchers[model_type]
+
+    @server.route("/predict", methods=["POST"])
+    def predict():
+        payload = request.get_json(silent=True)
+        if isinstance(payload, list):
+            payload = {"records": payload}
+        elif isinstance(payload, dict) and not {"model", "records", "record"} & payload.keys():
+            payload = {"record": payload}
+        if not isinstance(payload, dict):
+            return jsonify(error="Expected a JSON object or a list of records"), 400
+
+        model_type = payload.get("model", "linear")
+        if model_type not in MODEL_PARAMS:
+            return jsonify(error=f"Unknown model {model_type!r}, use one of {list(MODEL_PARAMS)}"), 400
+        records = payload.get("records", [payload.get("record")])
+        if not isinstance(records, list) or not records or not all(isinstance(record, dict) for record in records):
+            return jsonify(error="Records must be JSON objects"), 400
+        # checked before queueing, a bad record must not reach the batch
+        for i, record in enumerate(records):
+            bad = [key for key, value in record.items() if not isinstance(value, SCALAR_TYPES)]
+            if bad:
+                return jsonify(error=f"Record {i}: values of {bad} must be numbers, strings or null"), 400
+
+        try:
+            pred = get_batcher(model_type).submit(records)
+        except (TypeError, ValueError) as e:
+            return jsonify(error=f"Could not score the records: {e}"), 400
+        except Exception:
+            logging.exception("Prediction failed")
+            return jsonify(error="Prediction failed"), 500
+
+        return jsonify(
+            model=model_type,
+            predictions=[
+                {"Id": record.get("Id"), "SalePrice": float(p)}
+                for record, p in zip(records, pred)
+            ]
+        )
+
+    return predict
+
+
+def register_cache_stats(server, caches):
+    """Add the `/cache/stats` endpoint reporting cache hits and misses
+    Parameters:
+        server: flask.Flask
+            -> the server behind the Dash app
+        caches: dict
+            -> name -> object with a `stats()` method, eg. the figure cache
+    """
+    @server.route("/cache/stats", methods=["GET"])
+    def cache_stats():
+        return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+    return cache_stats
+
+
+def register_metrics(server, caches=None, registry=METRICS):
+    """Add the `/metrics` endpoint (Prometheus text format) and request tracing
+    - Every request gets a trace id, taken from the `X-Request-ID` header or
+      generated, it is logged with each record (see Metrics.TraceIdFilter)
+      and sent back in the `X-Request-ID` response header
+    - Request seconds are recorded per path, Dash callbacks per output
+
+    Parameters:
+        server: flask.Flask
+            -> the server behind the Dash app
+        caches: dict/None
+            -> name -> object with a `stats()` method, their hit and miss
+               counters are exported too
+        registry: MetricsRegistry
+            -> metrics of this process
+    """
+    caches = caches or {}
+    request_seconds = registry.histogram(
+        "amos_http_request_seconds", "Seconds per request, Dash callbacks by output",
+        ("path", "method", "status")
+    )
+
+    @server.before_request
+    def start_trace():
+        g.trace_token = new_trace_id(request.headers.get("X-Request-ID"))
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        if "request_start" in g:
+            path = request.path
+            if path.endswith("_dash-update-component"):
+                # the callback is identified by its outputs
+                payload = request.get_json(silent=True) or {}
+                path = f"{path}:{payload.get('output', '')}"
+            request_seconds.observe(
+                time.perf_counter() - g.request_start,
+                path=path, method=request.method, status=response.status_code
+            )
+        response.headers["X-Request-ID"] = current_trace_id()
+        return response
+
+    @server.teardown_request
+    def finish_trace(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            end_trace(token)
+
+    def cache_metrics():
+        lookups = Counter("amos_cache_lookups_total", "Cache lookups by tier, from cache stats()", ("cache", "result"))
+        for name, cache in caches.items():
+            stats = cache.stats()
+            for result in ("memory_hits", "disk_hits", "misses"):
+                if result in stats:
+                    lookups.inc(stats[result], cache=name, result=result)
+        return [lookups]
+
+    @server.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(registry.render(extra=cache_metrics()), mimetype="text/plain; version=0.0.4")
+
+    return metrics
@@ -0,0 +1,195 @@
+# Important libraries
+import argparse
+import fcntl
+import hashlib
+import inspect
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import sklearn
+
+import Training
+from Training import MODEL_PARAMS, compact_memory, file_fingerprint, preprocess_config
+
+
+class ArtifactStore:
+    """Keep fitted pipelines on disk so that workers do not retrain them
+    - One joblib file per fitted pipeline plus a JSON manifest
+    - Entries are keyed by the train.csv content hash, the sklearn version
+      and the pipeline hyperparameters; a mismatch makes the entry stale
+    - Manifest updates hold an exclusive lock on `manifest.lock`, so workers
+      saving at the same time do not drop each other's entries
+
+    Parameters:
+        root_path: str/Path object
+            -> directory holding the artifacts and `manifest.json`
+        data_file: str/Path object
+            -> training csv file the artifacts were built from
+    """
+    def __init__(
+        self,
+        root_path = Path.cwd() / "artifacts",
+        data_file = Path.cwd() / "train.csv"
+    ):
+        self.root_path = Path(root_path)
+        self.data_file = Path(data_file)
+        self.manifest_path = self.root_path / "manifest.json"
+        self.lock_path = self.root_path / "manifest.lock"
+
+    # code that shapes the stored artifacts, changing it makes them stale
+    @staticmethod
+    def code_fingerprint():
+        """Hash of the wrangling and pipeline code"""
+        source = "".join(
+            inspect.getsource(obj)
+            for obj in (
+                Training.engineer_features,
+                Training.WrangleRepository,
+                Training.FeatureTransformer,
+                Training.MakePipeline
+            )
+        )
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def entry_key(self, name):
+        """Everything an artifact depends on
+        Parameters:
+            name: str
+                -> a model type, `<model type>_importance`, `training_data` or
+               `feature_transformer`
+        """
+        key = {
+            "data_hash": file_fingerprint(self.data_file),
+            "sklearn_version": sklearn.__version__,
+            "code": self.code_fingerprint(),
+            # compact mode stores (and fits on) frames with smaller dtypes
+            "compact": compact_memory(),
+            "preprocess": preprocess_config()
+        }
+        # eg. `forest` or `forest_importance`, both depend on the forest params
+        model_type = name.split("_")[0]
+        if model_type in MODEL_PARAMS:
+            key["params"] = MODEL_PARAMS[model_type]
+        return key
+
+    def read_manifest(self):
+        """Load the manifest, an empty one if the store is new"""
+        try:
+            return json.loads(self.manifest_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextmanager
+    def _manifest_lock(self):
+        """Exclusive lock across processes for a manifest read-modify-write"""
+        self.root_path.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_manifest(self, manifest):
+        tmp_path = self.manifest_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True, default=str))
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_fresh(self, name):
+        """True when the stored artifact matches the current data, sklearn and params"""
+        entry = self.read_manifest().get(name)
+        if entry is None or not (self.root_path / entry["file"]).exists():
+            return False
+        key = json.loads(json.dumps(self.entry_key(name), default=str))
+        return entry["key"] == key
+
+    def load(self, name, mmap_mode="r"):
+        """Load a stored artifact, None if it is missing or stale
+        Parameters:
+            name: str
+                -> a model type, `training_data` or `feature_transformer`
+            mmap_mode: str/None
+                -> numpy arrays are memory mapped so that workers share pages
+        """
+        if not self.is_fresh(name):
+            return None
+        entry = self.read_manifest()[name]
+        logging.info(f"Loading the {name} artifact from {entry['file']}")
+        return joblib.load(self.root_path / entry["file"], mmap_mode=mmap_mode)
+
+    def save(self, name, obj):
+        """Store an artifact and record it in the manifest"""
+        self.root_path.mkdir(parents=True, exist_ok=True)
+        key = self.entry_key(name)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+        file_name = f"{name}-{digest[:16]}.joblib"
+
+        # write to a temporary file first, readers never see half a file
+        tmp_path = self.root_path / f"{file_name}.{os.getpid()}.tmp"
+        joblib.dump(obj, tmp_path)
+        os.replace(tmp_path, self.root_path / file_name)
+
+        with self._manifest_lock():
+            manifest = self.read_manifest()
+            old_entry = manifest.get(name)
+            manifest[name] = {
+                "file": file_name,
+                "key": key,
+                "created": datetime.now(timezone.utc).isoformat()
+            }
+            self._write_manifest(manifest)
+
+        # remove the artifact this one replaced
+        if old_entry and old_entry["file"] != file_name:
+            (self.root_path / old_entry["file"]).unlink(missing_ok=True)
+        logging.info(f"Stored the {name} artifact in {file_name}")
+
+    def clear(self):
+        """Remove every artifact and the manifest"""
+        if not self.root_path.exists():
+            return
+        with self._manifest_lock():
+            for entry in self.read_manifest().values():
+                (self.root_path / entry["file"]).unlink(missing_ok=True)
+            self.manifest_path.unlink(missing_ok=True)
+
+    def __repr__(self):
+        return f"ArtifactStore root_path={self.root_path}"
+
+
+def main(argv=None):
+    """Pre-build the artifact store, eg. during deploy:
+        python Artifacts.py build
+    """
+    parser = argparse.ArgumentParser(description="Manage the fitted pipeline artifacts")
+    parser.add_argument("command", choices=["build", "status", "clear"])
+    parser.add_argument("--root", default=Path.cwd() / "artifacts", type=Path,
+                        help="artifact directory")
+    parser.add_argument("--force", action="store_true",
+                        help="retrain even if the stored artifacts are fresh")
+    args = parser.parse_args(argv)
+
+    store = ArtifactStore(root_path=args.root)
+    names = ["training_data", "feature_transformer", *MODEL_PARAMS]
+
+    if args.command == "clear":
+        store.clear()
+    elif args.command == "build":
+        # imported here, Business itself depends on this module
+        from Business import ModelRegistry
+        if args.force:
+            store.clear()
+        ModelRegistry(store=store).warm_start()
+
+    for name in names:
+        print(f"{name:20} {'fresh' if store.is_fresh(name) else 'stale'}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
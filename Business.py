@@ -1,99 +1,344 @@
-from Service import GetData, GetModel, LearningCurve, IDMapping
-from Training import TestPredicter
-
+from Service import GetData, GetModel, LearningCurve, IDMapping, FeatureImportance
+from Training import TestPredicter, StreamingPredicter, MakePipeline, MODEL_PARAMS, file_fingerprint, fit_head, preprocess_config, compact_memory
+from Artifacts import ArtifactStore
+from Inference import CompiledPipeline, PipelinePredictor
+from Figures import FigureCache, histogram_figure, scatter_data
+from Metrics import count, timed
+from Profiling import PROFILER
+
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import plotly
 import plotly.express as px 
 import pandas as pd
+import joblib
+import plotly.graph_objects as go
 from sklearn.pipeline import Pipeline
 
-class ModelBuilder:
-    def __init__(self):
-        """Init sections"""
-        
-    def linear_model(self):
-        # get the data 
-        df, df_raw = GetData().training_data()
-        # splitting the data 
-        target = "SalePrice"
-        X_train = df.drop(columns = target)
-        y_train = df[target]
-
-        
-        # get the pipeline
-        pipe = GetModel(X_train=X_train).build_linear_model()
-
-
-        # Training the model 
-        model = pipe.fit(X_train,y_train)
-
-        self.model = model 
-        self.X_train = X_train
-        self.y_train = y_train
-
+# Process wide model registry
+class ModelRegistry:
+    """Keep fitted model pipelines for the life of the worker
+    - Pipelines are keyed by model type plus a fingerprint of the training
+      data and of the model hyperparameters
+    - Threads asking for the same key wait for a single fit instead of
+      starting duplicates
+
+    Parameters:
+        store: ArtifactStore
+            -> on-disk store tried before fitting, fitted pipelines are
+               saved back into it (None disables it)
+    """
+    def __init__(self, store=None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._data = {}
+        self._models = {}
+
+    def _get_or_build(self, store, key, build):
+        """Return store[key], building it once if it is missing"""
+        with self._lock:
+            if key in store:
+                count("amos_cache_requests_total", help="Cache lookups by result", cache="registry", result="hit")
+                return store[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # another thread may have finished the build while we waited
+            with self._lock:
+                if key in store:
+                    count("amos_cache_requests_total", help="Cache lookups by result", cache="registry", result="hit")
+                    return store[key]
+            count("amos_cache_requests_total", help="Cache lookups by result", cache="registry", result="miss")
+            value = build()
+            with self._lock:
+                store[key] = value
+        return value
+
+    @staticmethod
+    def data_fingerprint():
+        """Fingerprint of the training csv file"""
+        return file_fingerprint(GetData().repo.filepath)
+
+    @staticmethod
+    def params_fingerprint(model_type):
+        """Fingerprint of the hyperparameters of one model type and of the preprocessing"""
+        params = json.dumps([MODEL_PARAMS[model_type], preprocess_config()], sort_keys=True, default=str)
+        return hashlib.sha1(params.encode()).hexdigest()
+
+    def model_key(self, model_type):
+        """Registry key of a model type for the current training data"""
+        return (model_type, self.data_fingerprint(), self.params_fingerprint(model_type))
+
+    def training_data(self):
+        """Get the (X_train, y_train) split, wrangled once per data fingerprint"""
+        def build():
+            stored = self.store.load("training_data") if self.store else None
+            if stored is not None:
+                return stored
+            df, df_raw = GetData().training_data()
+            target = "SalePrice"
+            split = df.drop(columns=target), df[target]
+            if self.store:
+                self.store.save("training_data", split)
+            return split
+
+        return self._get_or_build(self._data, self.data_fingerprint(), build)
+
+    def feature_transformer(self):
+        """Get the FeatureTransformer fitted on the training data"""
+        def build():
+            stored = self.store.load("feature_transformer") if self.store else None
+            if stored is not None:
+                return stored
+            transformer = GetData().feature_transformer()
+            if self.store:
+                self.store.save("feature_transformer", transformer)
+            return transformer
+
+        return self._get_or_build(self._data, (self.data_fingerprint(), "transformer"), build)
+
+    def get_model(self, model_type):
+        """Get a fitted pipeline of the given model type
+        Parameters:
+            model_type: str
+                -> one of linear, tree, forest, gradient
+        """
+        if model_type not in MODEL_PARAMS:
+            raise ValueError(f"Unknown model type: {model_type}")
+        X_train, y_train = self.training_data()
+
+        def build():
+            stored = self.store.load(model_type) if self.store else None
+            if stored is not None:
+                return stored
+            logging.info(f"Fitting the {model_type} model pipeline")
+            pipe = getattr(GetModel(X_train=X_train), f"build_{model_type}_model")()
+            # the four models share one fitted column transformer
+            model = MakePipeline(X_train).fit_shared(pipe, y_train)
+            if self.store:
+                self.store.save(model_type, model)
+            return model
+
+        model = self._get_or_build(self._models, self.model_key(model_type), build)
         return model, X_train, y_train
-        
-    def tree_model(self):
-        # get the data 
-        df, df_raw = GetData().training_data()
-        # splitting the data 
-        target = "SalePrice"
-        X_train = df.drop(columns = target)
-        y_train = df[target]
 
-        
-        # get the pipeline
-        pipe = GetModel(X_train=X_train).build_tree_model()
+    def set_model(self, model_type, model):
+        """Replace the fitted pipeline of a model type, eg. after a refresh"""
+        with self._lock:
+            for key in [k for k in self._models if k[0] == model_type]:
+                del self._models[key]
+            self._models[self.model_key(model_type)] = model
+        if self.store:
+            self.store.save(model_type, model)
+
+    def compiled_model(self, model_type):
+        """Get the NumPy only scorer exported from a fitted pipeline
+        - Pipelines that cannot be compiled (eg. hist gradient boosting) are
+          served by a PipelinePredictor with the same interface
+        """
+        model, X_train, y_train = self.get_model(model_type)
+
+        def build():
+            try:
+                return CompiledPipeline(model)
+            except ValueError as e:
+                logging.info(f"Serving the {model_type} model through sklearn: {e}")
+                return PipelinePredictor(model)
+
+        key = (*self.model_key(model_type), "compiled")
+        return self._get_or_build(self._models, key, build)
+
+    def feature_importance(self, model_type, method="native"):
+        """Importances per source column of a fitted model, computed once
+        Parameters:
+            model_type: str
+                -> one of linear, tree, forest, gradient
+            method: str
+                -> native (coefficient contributions/impurity) or permutation (held-out
+                   split, kept in the artifact store as it is slow)
+        Returns:
+            pd.Series sorted by decreasing importance
+        """
+        model, X_train, y_train = self.get_model(model_type)
+
+        def build():
+            if method == "native":
+                return FeatureImportance(model, X_train, y_train).native().sort_values(key=abs, ascending=False)
+            name = f"{model_type}_importance"
+            stored = self.store.load(name) if self.store else None
+            if stored is not None:
+                return stored
+            logging.info(f"Computing the {model_type} permutation importance")
+            importance = FeatureImportance(model, X_train, y_train).permutation()
+            importance = importance.sort_values(key=abs, ascending=False)
+            if self.store:
+                self.store.save(name, importance)
+            return importance
+
+        if method not in ("native", "permutation"):
+            raise ValueError(f"Unknown importance method: {method}")
+        key = (*self.model_key(model_type), "importance", method)
+        return self._get_or_build(self._models, key, build)
+
+    def warm_start(self):
+        """Load every model into the registry, eg. when a worker boots"""
+        self.feature_transformer()
+        for model_type in MODEL_PARAMS:
+            self.get_model(model_type)
+
+    def invalidate(self, model_type=None):
+        """Drop fitted pipelines so that they are rebuilt on the next request
+        Parameters:
+            model_type: str
+                -> drop only this model type, by default everything
+                   (the cached training data included) is dropped
+        """
+        with self._lock:
+            if model_type is None:
+                self._data.clear()
+                self._models.clear()
+            else:
+                for key in [k for k in self._models if k[0] == model_type]:
+                    del self._models[key]
+
+    def __repr__(self):
+        return f"ModelRegistry models={sorted(self._models)}"
+
+
+model_registry = ModelRegistry(store=ArtifactStore())
 
 
-        # Training the model 
-        model = pipe.fit(X_train,y_train)
-
-        self.model = model 
+class ModelBuilder:
+    def __init__(self, registry=None):
+        """Init sections
+        Parameters:
+            registry: ModelRegistry
+                -> where fitted pipelines are kept, the process wide
+                   registry by default
+        """
+        self.registry = model_registry if registry is None else registry
+
+    @PROFILER.profiled("ModelBuilder.build")
+    def build(self, model_type):
+        """Get a fitted model together with its training data"""
+        model, X_train, y_train = self.registry.get_model(model_type)
+
+        self.model = model
         self.X_train = X_train
         self.y_train = y_train
 
         return model, X_train, y_train
-    def forest_model(self):
-        # get the data 
-        df, df_raw = GetData().training_data()
-        # splitting the data 
-        target = "SalePrice"
-        X_train = df.drop(columns = target)
-        y_train = df[target]
-
-        
-        # get the pipeline
-        pipe = GetModel(X_train=X_train).build_forest_model()
 
+    def linear_model(self):
+        return self.build("linear")
 
-        # Training the model 
-        model = pipe.fit(X_train,y_train)
+    def tree_model(self):
+        return self.build("tree")
 
-        self.model = model 
-        self.X_train = X_train
-        self.y_train = y_train
+    def forest_model(self):
+        return self.build("forest")
 
-        return model, X_train, y_train
     def gradient_model(self):
-        # get the data 
-        df, df_raw = GetData().training_data()
-        # splitting the data 
-        target = "SalePrice"
-        X_train = df.drop(columns = target)
-        y_train = df[target]
-
-        
-        # get the pipeline
-        pipe = GetModel(X_train=X_train).build_gradient_model()
-
-
-        # Training the model 
-        model = pipe.fit(X_train,y_train)
-
-        self.model = model 
-        self.X_train = X_train
-        self.y_train = y_train
-
-        return model, X_train, y_train
+        return self.build("gradient")
+
+    @staticmethod
+    def cpu_shares(model_types, cpu_budget, threaded=("forest",)):
+        """CPUs per model: one each, the spare ones are split between the
+        models that fit in parallel (forest n_jobs, hist gradient OpenMP)
+        """
+        shares = {model_type: 1 for model_type in model_types}
+        threaded = [model_type for model_type in model_types if model_type in threaded]
+        spare = cpu_budget - len(model_types)
+        for i, model_type in enumerate(threaded):
+            shares[model_type] += max(0, spare) // len(threaded) + (i < max(0, spare) % len(threaded))
+        return shares
+
+    @PROFILER.profiled("ModelBuilder.train_all")
+    def train_all(self, model_types=None, cpu_budget=None):
+        """Refit every model pipeline, concurrently when CPUs allow
+        - The training data is wrangled and preprocessed once; the model
+          heads are fitted in a process pool on a memory mapped copy of the
+          preprocessed matrix (in /dev/shm when available). Pipelines with
+          their own preprocessing (hist gradient) are fitted whole
+        - Pool workers plus the forest n_jobs never exceed cpu_budget
+        - The refitted pipelines replace the ones in the registry
+
+        Parameters:
+            model_types: list
+                -> models to fit, all of MODEL_PARAMS by default
+            cpu_budget: int
+                -> CPUs to use, the CPUs this process may run on by default
+        Returns:
+            dict with the fit seconds and CPUs of every model and the wall time
+        """
+        start = time.perf_counter()
+        model_types = list(MODEL_PARAMS) if model_types is None else model_types
+        if cpu_budget is None:
+            cpu_budget = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        cpu_budget = max(1, cpu_budget or 1)
+
+        # load, wrangle and preprocess once
+        X_train, y_train = self.registry.training_data()
+        col_pipeline, Xt = MakePipeline(X_train).preprocess()
+        pipes = {
+            model_type: getattr(GetModel(X_train=X_train), f"build_{model_type}_model")()
+            for model_type in model_types
+        }
+        shared = {model_type: MakePipeline.shares_preprocess(pipe) for model_type, pipe in pipes.items()}
+
+        workers = min(len(model_types), cpu_budget)
+        threaded = [m for m in model_types if m == "forest" or not shared[m]]
+        shares = (self.cpu_shares(model_types, cpu_budget, threaded) if workers > 1
+                  else {m: cpu_budget for m in model_types})
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        with tempfile.TemporaryDirectory(dir=shm, prefix="amos-train-") as tmp_dir:
+            matrix_path = Path(tmp_dir) / "train.joblib"
+            frame_path = Path(tmp_dir) / "frame.joblib"
+            joblib.dump((Xt, y_train.to_numpy()), matrix_path)
+            if not all(shared.values()):
+                joblib.dump((X_train, y_train.to_numpy()), frame_path)
+            # model head on the shared matrix, or the whole pipeline on the frame
+            tasks = {
+                model_type: (pipe.steps[-1][1], matrix_path) if shared[model_type] else (pipe, frame_path)
+                for model_type, pipe in pipes.items()
+            }
+
+            if workers > 1:
+                logging.info(f"Fitting {model_types} in {workers} processes, CPU shares {shares}")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = {
+                        model_type: pool.submit(fit_head, estimator, path, shares[model_type])
+                        for model_type, (estimator, path) in tasks.items()
+                    }
+                    fitted = {model_type: future.result() for model_type, future in futures.items()}
+            else:
+                fitted = {
+                    model_type: fit_head(estimator, path, shares[model_type])
+                    for model_type, (estimator, path) in tasks.items()
+                }
+
+        stats = {}
+        for model_type, (estimator, seconds) in fitted.items():
+            if shared[model_type]:
+                head_name = pipes[model_type].steps[-1][0]
+                estimator = Pipeline([("preprocess", col_pipeline), (head_name, estimator)])
+            self.registry.set_model(model_type, estimator)
+            stats[model_type] = {"fit_seconds": round(seconds, 3), "cpus": shares[model_type]}
+        stats["wall_seconds"] = round(time.perf_counter() - start, 3)
+        return stats
 
 class MapId:
     def __init__(self):
@@ -103,27 +348,163 @@ class MapId:
         model, X_train, y_train = ModelBuilder().linear_model()
     
         # Get the test set
-        test_data = IDMapping().get_test_data()
+        test_data = IDMapping().get_test_data(transformer=model_registry.feature_transformer())
     
         # predictions
         sub = TestPredicter(test_data = test_data, model=model).id_mapper(label=label)
         return sub
 
+    def stream(self, input_path, output_path, model_type="linear", chunksize=50_000, n_jobs=1):
+        """Score a large csv/parquet file (test.csv layout) into output_path
+        - Chunks are wrangled and scored one at a time, see StreamingPredicter
+        - Returns the throughput and peak RSS stats
+        """
+        model, X_train, y_train = ModelBuilder().build(model_type)
+        transform = model_registry.feature_transformer()
+        scorer = StreamingPredicter(model=model, transform=transform, chunksize=chunksize, n_jobs=n_jobs)
+        return scorer.predict_file(input_path, output_path)
+
+# Rendered figures, shared with the other workers through .cache/figures
+figure_cache = FigureCache()
+
+@functools.cache
+def _figure_code_fingerprint():
+    """Hash of the code and library versions that shape the figures
+    - Whole source files of the figure builders and of the modules they
+      use (Business, Service, Training, Figures), so that any change to
+      them retires the figures in the shared disk tier
+    """
+    digest = hashlib.sha1(plotly.__version__.encode())
+    for obj in (GraphBuilder, GetData, TestPredicter, histogram_figure):
+        digest.update(Path(inspect.getsourcefile(obj)).read_bytes())
+    return digest.hexdigest()
+
+def figure_fingerprint(registry=None):
+    """Fingerprint of everything a figure depends on: data, models and code"""
+    registry = model_registry if registry is None else registry
+    params = [registry.params_fingerprint(model_type) for model_type in MODEL_PARAMS]
+    # compact mode trains on frames with other dtypes, as in the artifact key
+    return (registry.data_fingerprint(), *params, compact_memory(), _figure_code_fingerprint())
+
+def figure_arguments(func, self, args, kwargs):
+    """Arguments of a figure call with defaults applied, the same key
+    whether they were passed by position or by keyword
+    """
+    bound = inspect.signature(func).bind(self, *args, **kwargs)
+    bound.apply_defaults()
+    return tuple((name, value) for name, value in bound.arguments.items() if name != "self")
+
+def cached_figure(method):
+    """Serve a GraphBuilder figure from the figure cache, render it on a miss
+    - Serving and rendering seconds are recorded per figure in the metrics
+    """
+    def render(self, *args, **kwargs):
+        with timed("amos_figure_render_seconds", "Seconds rendering a figure on a cache miss", figure=method.__name__):
+            return method(self, *args, **kwargs)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with timed("amos_figure_seconds", "Seconds serving a GraphBuilder figure", figure=method.__name__):
+            if self.cache is None:
+                return render(self, *args, **kwargs)
+            arguments = figure_arguments(method, self, args, kwargs)
+            key = (method.__name__, arguments, self.render_options(), figure_fingerprint())
+            payload = self.cache.get_or_render(key, lambda: render(self, *args, **kwargs))
+            return self.restore(json.loads(payload))
+    return wrapper
+
 # Graph builder 
 class GraphBuilder:
     """This module has functions that will help in building the graphs
     -> Building the histogram(saleprice)
+    - Figures are served from the figure cache, built once per data,
+      model and code fingerprint
+
+    Parameters:
+        use_cache: bool
+            -> serve figures from the process figure cache
+        as_dict: bool
+            -> return plain figure dicts instead of go.Figure objects,
+               Dash accepts both and dicts skip the figure validation
+        webgl_threshold: int
+            -> scatter plots with more points are drawn with WebGL
+        aggregate_threshold: int
+            -> scatter plots with more points are downsampled (LTTB)
+        max_points: int
+            -> points per series left after downsampling
     """
+    def __init__(self, use_cache=True, as_dict=False, webgl_threshold=5_000,
+                 aggregate_threshold=50_000, max_points=5_000):
+        self.use_cache = use_cache
+        self.as_dict = as_dict
+        self.webgl_threshold = webgl_threshold
+        self.aggregate_threshold = aggregate_threshold
+        self.max_points = max_points
+
+    def render_options(self):
+        """Settings that change the rendered figures, part of the cache key"""
+        return (self.webgl_threshold, self.aggregate_threshold, self.max_points)
+
+    def scatter_data(self, df, x, value_vars):
+        """Long frame and render mode of a scatter plot, see Figures.scatter_data"""
+        return scatter_data(df, x, value_vars, webgl_threshold=self.webgl_threshold,
+                            aggregate_threshold=self.aggregate_threshold, max_points=self.max_points)
+
+    # looked up on use so that the builder stays picklable for the jobs
+    @property
+    def cache(self):
+        return figure_cache if self.use_cache else None
+
+    def restore(self, result):
+        """Turn cached JSON back into figures"""
+        if isinstance(result, list):
+            return tuple(self.restore(item) for item in result)
+        if isinstance(result, dict) and not self.as_dict:
+            return go.Figure(result, skip_invalid=True)
+        return result
+
+    def peek(self, name, *args, **kwargs):
+        """A cached figure without rendering it, None on a miss"""
+        if self.cache is None:
+            return None
+        arguments = figure_arguments(getattr(GraphBuilder, name).__wrapped__, self, args, kwargs)
+        payload = self.cache.get((name, arguments, self.render_options(), figure_fingerprint()))
+        return None if payload is None else self.restore(json.loads(payload))
+
+    def figure_calls(self):
+        """(method name, arguments) of every figure the app shows"""
+        calls = [("house_price_hist", ()), ("pca_plot", ()), ("residual_plot", ())]
+        for model_type in MODEL_PARAMS:
+            calls += [
+                (f"learning_curve_{model_type}", ()),
+                ("scatter_plot", (model_type,)),
+                ("feature_importance", (model_type,))
+            ]
+            if model_type != "linear":
+                calls.append(("residual_tree_plot", (model_type,)))
+        return calls
+
+    def warm(self):
+        """Render every figure into the cache, returns seconds per figure"""
+        timings = {}
+        for name, args in self.figure_calls():
+            start = time.perf_counter()
+            getattr(self, name)(*args)
+            timings[f"{name}{args!r}"] = round(time.perf_counter() - start, 3)
+        return timings
+
+    @cached_figure
     def house_price_hist(self):
         """Plot a histogram for house prices"""
         # get the data 
         house_prices = GetData().get_sale_price() 
 
-        # plotting the histogram 
-        fig = px.histogram(
+        # plotting the histogram from precomputed bin counts
+        fig = histogram_figure(
             house_prices, 
             title="Distribution: Amos House Sale Price", 
-            nbins=50
+            nbins=50,
+            name="SalePrice"
         )
         fig.update_layout(
             xaxis_title="Sale Price",
@@ -134,17 +515,26 @@ class GraphBuilder:
         # return figure 
         self.fig = fig 
         return fig 
+    @cached_figure
     def pca_plot(self):
         """Build a pca plot figure"""
         # Get the raw dataset with all the features 
         df, raw_data = GetData().training_data()
         # get the pca data 
         pca_data = GetData(X_train=raw_data).get_pca_data()
-    
+
+        # WebGL and downsampling once the data gets large
+        df_plot, render_mode, note = self.scatter_data(
+            pd.DataFrame({"x": pca_data.ravel(), "SalePrice": raw_data["SalePrice"].to_numpy()}),
+            x="x",
+            value_vars=["SalePrice"]
+        )
         fig = px.scatter(
-            x=pca_data.ravel(),
-            y=raw_data["SalePrice"],
-            title="Scatter Plot: Decomposed Features vs. Sale Price"
+            data_frame=df_plot,
+            x="x",
+            y="value",
+            render_mode=render_mode,
+            title=f"Scatter Plot: Decomposed Features vs. Sale Price{note}"
         )
     
         fig.update_layout(
@@ -159,6 +549,7 @@ class GraphBuilder:
         return fig
 
     # plotting leaning curve
+    @cached_figure
     def learning_curve_linear(self):
         # Get the model(linear model) 
         model, X, y = ModelBuilder().linear_model()
@@ -171,6 +562,7 @@ class GraphBuilder:
 
         return fig
     
+    @cached_figure
     def learning_curve_tree(self):
         # Get the model(linear model) 
         model, X, y = ModelBuilder().tree_model()
@@ -182,6 +574,7 @@ class GraphBuilder:
         fig = lc.plot_lc()
 
         return fig
+    @cached_figure
     def learning_curve_forest(self):
         
         model, X, y = ModelBuilder().forest_model()
@@ -192,6 +585,7 @@ class GraphBuilder:
         fig = lc.plot_lc()
 
         return fig
+    @cached_figure
     def learning_curve_gradient(self):
         
         model, X, y = ModelBuilder().gradient_model()
@@ -204,6 +598,7 @@ class GraphBuilder:
         return fig
 
     # plotting scatter plot 
+    @cached_figure
     def scatter_plot(self, plot_type):
         """Make a scatter plot comparing actual vs. predicted values"""
         
@@ -242,22 +637,17 @@ class GraphBuilder:
             "y_pred": y_pred
         })
 
-        # melting the dataframe for easier plotting 
-        df_melt = pd.melt(
-            frame=df,
-            id_vars="x",
-            value_vars=["y", "y_pred"],
-            var_name="Set",
-            value_name="Sale Price"
-        )
+        # melting the dataframe for easier plotting, downsampled when large
+        df_melt, render_mode, note = self.scatter_data(df, x="x", value_vars=["y", "y_pred"])
 
         # Making the scatter plot
         fig = px.scatter(
             data_frame=df_melt,
             x="x",
-            y="Sale Price",
+            y="value",
             color="Set",
-            title=f"{label} Scatter Plot: Decomposed Features vs. Sale Price"
+            render_mode=render_mode,
+            title=f"{label} Scatter Plot: Decomposed Features vs. Sale Price{note}"
         )
     
         fig.update_layout(
@@ -270,16 +660,17 @@ class GraphBuilder:
         # return 
         return fig
 
+    @cached_figure
     def residual_plot(self):
         # Get the model 
         model, X, y = ModelBuilder().linear_model()
 
         residuals = y - model.predict(X)
         # residual distributions
-        fig = px.histogram(
+        fig = histogram_figure(
             residuals,
             nbins=50,
-            labels = "Residuals",
+            name = "Residuals",
             title = "Predicted Sale Price: Linear Regression Model Residuals Distribution"
         )
         fig.update_layout(
@@ -290,6 +681,7 @@ class GraphBuilder:
         )
 
         return fig
+    @cached_figure
     def residual_tree_plot(self, model_type):
         """Displaying the educative text and also getting the figure"""
         text = f"Tree models, are more conserned with purity.\n A random scatter of the residuals may still shows that the tree is fitting well. \nPattern might hint underfitting or missing feature. Keep this in mind!👌"
@@ -308,10 +700,10 @@ class GraphBuilder:
             
         residuals = y - model.predict(X)
         # residual distributions
-        fig = px.histogram(
+        fig = histogram_figure(
             residuals,
             nbins=50,
-            labels = "Residuals",
+            name = "Residuals",
             title = f"Predicted Sale Price: {label} Model Residuals Distribution"
         )
         fig.update_layout(
@@ -325,107 +717,81 @@ class GraphBuilder:
         
         
 
-    def feature_importance(self, model_type):
-        if model_type == "linear":
-            # geting the model 
-            model, X, y = ModelBuilder().linear_model()
-    
-            # Getting feature importances
-            coeficients = model.named_steps["linear_model"].coef_
-            features  = model.named_steps["preprocess"].get_feature_names_out().ravel()
-            features = [f.split("__")[1] for f in features]
-            
-            # making feature importances
-            feat_imp = pd.Series(coeficients, index=features, name="feature importance").sort_values(key=abs)
-                    
-            # feature imporances plot 
-            fig = px.bar(
-                feat_imp.tail(10), 
-                orientation = "h",
-                title = "Top 10: Linear Model Feature importance plot"
-            )
-            fig.update_layout(
-                xaxis_title = "Importances",
-                yaxis_title = "Features",
-                legend_title = "Item",
-                template = "plotly_white"
-            )
-                    
-            return fig   
-        elif model_type == "tree":
-            # Get the model
-            model, X, y = ModelBuilder().tree_model()
-            
-            # Get feature importances
-            coeficients = model.named_steps["tree_model"].feature_importances_
-            features  = model.named_steps["preprocess"].get_feature_names_out().ravel()
-            features = [f.split("__")[1] for f in features]
-            
-            # making feature importances
-            feat_imp = pd.Series(coeficients, index=features, name="feature importance").sort_values(key=abs)
-
-            # Making the bar plot
-            fig = px.bar(
-                    feat_imp.tail(10), 
-                    orientation = "h",
-                    title = "Top 10: Decision Tree Model Feature importances plot"
-                )
-            fig.update_layout(
-                xaxis_title = "Importances",
-                yaxis_title = "Features",
-                template = "plotly_white",
-                legend_title = "Item"
-                    
-            )
-            return fig
-        elif model_type == "forest":
-            # Get the model
-            model, X, y = ModelBuilder().forest_model()
-            
-            # Get feature importances
-            coeficients = model.named_steps["forest_model"].feature_importances_
-            features  = model.named_steps["preprocess"].get_feature_names_out().ravel()
-            features = [f.split("__")[1] for f in features]
-            
-            # making feature importances
-            feat_imp = pd.Series(coeficients, index=features, name="feature importance").sort_values(key=abs)
-
-            # Making the bar plot
-            fig = px.bar(
-                    feat_imp.tail(10), 
-                    orientation = "h",
-                    title = "Top 10: Random Forest Model Feature importances plot"
-                )
-            fig.update_layout(
-                xaxis_title = "Importances",
-                yaxis_title = "Features",
-                legend_title = "Item"
-                    
-            )
-            return fig
+    @cached_figure
+    def feature_importance(self, model_type, method="native", top=10):
+        """Top features of a model, dummies summed into their source column
+        Parameters:
+            model_type: str
+                -> one of linear, tree, forest, gradient
+            method: str
+                -> native or permutation, models without native importances
+                   (hist gradient boosting) always use permutation
+            top: int
+                -> number of features shown
+        """
+        labels = {
+            "linear": "Linear Model",
+            "tree": "Decision Tree Model",
+            "forest": "Random Forest Model",
+            "gradient": "Gradient Boosting Model"
+        }
+        # importances are computed once per fitted model by the registry
+        builder = ModelBuilder()
+        model, X, y = builder.build(model_type)
+        head = model.steps[-1][1]
+        if not (hasattr(head, "feature_importances_") or hasattr(head, "coef_")):
+            method = "permutation"
+        feat_imp = builder.registry.feature_importance(model_type, method=method)
+
+        # feature imporances plot, largest at the top
+        fig = px.bar(
+            feat_imp.head(top).iloc[::-1], 
+            orientation = "h",
+            title = f"Top {top}: {labels[model_type]} Feature importances plot"
+        )
+        fig.update_layout(
+            xaxis_title = "Importances" if method == "native" else "Mean R2 drop (permutation)",
+            yaxis_title = "Features",
+            legend_title = "Item",
+            template = "plotly_white"
+        )
+        return fig
 
-        else:
-            # Get the model
-            model, X, y = ModelBuilder().gradient_model()
-            
-            # Get feature importances
-            coeficients = model.named_steps["forest_model"].feature_importances_
-            features  = model.named_steps["preprocess"].get_feature_names_out().ravel()
-            features = [f.split("__")[1] for f in features]
-            
-            # making feature importances
-            feat_imp = pd.Series(coeficients, index=features, name="feature importance").sort_values(key=abs)
-
-            # Making the bar plot
-            fig = px.bar(
-                    feat_imp.tail(10), 
-                    orientation = "h",
-                    title = "Top 10: Gradient Boosting Model Feature importances plot"
-                )
-            fig.update_layout(
-                xaxis_title = "Importances",
-                yaxis_title = "Features",
-                legend_title = "Item"
-                    
-            )
-            return fig
\ No newline at end of file
+
+def main(argv=None):
+    """Command line tasks:
+        python Business.py score big_test.csv predictions.parquet --model forest --jobs 4
+        python Business.py warm-figures
+        python Business.py train --cpus 4
+    """
+    parser = argparse.ArgumentParser(description="Amos house price tasks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score = commands.add_parser("score", help="stream predictions for a large input file")
+    score.add_argument("input", help="csv or parquet file with the test.csv columns")
+    score.add_argument("output", help="csv or parquet file for the Id -> SalePrice mapping")
+    score.add_argument("--model", default="linear", choices=list(MODEL_PARAMS))
+    score.add_argument("--chunksize", type=int, default=50_000)
+    score.add_argument("--jobs", type=int, default=1)
+    warm = commands.add_parser("warm-figures", help="render every figure into the figure cache, eg. at deploy")
+    warm.add_argument("--clear", action="store_true", help="drop the cached figures first")
+    train = commands.add_parser("train", help="refit every model pipeline in parallel")
+    train.add_argument("--cpus", type=int, default=None, help="CPU budget, all CPUs by default")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        print(json.dumps(ModelBuilder().train_all(cpu_budget=args.cpus), indent=2))
+    elif args.command == "warm-figures":
+        if args.clear:
+            figure_cache.clear()
+        timings = GraphBuilder().warm()
+        print(json.dumps({"seconds": timings, "cache": figure_cache.stats()}, indent=2))
+    elif args.command == "score":
+        stats = MapId().stream(args.input, args.output, model_type=args.model,
+                               chunksize=args.chunksize, n_jobs=args.jobs)
+        print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,277 @@
+# Important libraries
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+
+class FigureCache:
+    """Keep rendered Plotly figures as serialized JSON
+    - An in-memory LRU of JSON strings, evicted by entry count and size
+    - An optional directory tier shared by every gunicorn worker (and the
+      job processes), written atomically so readers never see half a file
+    - Keys must contain everything the figure depends on (eg. data and
+      model fingerprints), stale entries are never looked up again; the
+      directory is pruned after a write, least recently used files first,
+      so the entries of old fingerprints age out
+
+    Parameters:
+        max_entries: int
+            -> figures kept in memory
+        max_bytes: int
+            -> total size of the JSON kept in memory
+        disk_path: str/Path object/None
+            -> directory of the shared tier, None keeps figures in memory only
+        max_disk_bytes: int
+            -> total size of the JSON files kept in the directory
+    """
+    def __init__(
+        self,
+        max_entries = 64,
+        max_bytes = 64 * 2**20,
+        disk_path = Path.cwd() / ".cache" / "figures",
+        max_disk_bytes = 256 * 2**20
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_path = None if disk_path is None else Path(disk_path)
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(key):
+        """File name safe digest of a cache key"""
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    @staticmethod
+    def serialize(result):
+        """JSON of a figure, or of a tuple holding figures"""
+        return json.dumps(result, cls=PlotlyJSONEncoder, separators=(",", ":"))
+
+    def _remember(self, digest, payload):
+        """Add to the memory tier, evicting the least recently used"""
+        with self._lock:
+            if digest in self._memory:
+                return
+            self._memory[digest] = payload
+            self._bytes += len(payload)
+            while self._memory and (len(self._memory) > self.max_entries or self._bytes > self.max_bytes):
+                old_digest, old_payload = self._memory.popitem(last=False)
+                self._bytes -= len(old_payload)
+
+    def _read_disk(self, digest):
+        if self.disk_path is None:
+            return None
+        path = self.disk_path / f"{digest}.json"
+        try:
+            payload = path.read_text()
+        except FileNotFoundError:
+            return None
+        try:
+            # the modification time orders the files for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def _write_disk(self, digest, payload):
+        if self.disk_path is None:
+            return
+        try:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.disk_path / f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp_path.write_text(payload)
+            os.replace(tmp_path, self.disk_path / f"{digest}.json")
+        except OSError:
+            # the memory tier still serves the figure
+            logging.exception("Could not write the figure cache entry")
+            return
+        self.prune_disk()
+
+    def prune_disk(self):
+        """Remove the least recently used files beyond max_disk_bytes"""
+        if self.disk_path is None or not self.disk_path.exists():
+            return
+        files = []
+        for path in self.disk_path.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def get(self, key):
+        """Cached JSON of a key, None on a miss"""
+        digest = self.digest(key)
+        with self._lock:
+            payload = self._memory.get(digest)
+            if payload is not None:
+                self._memory.move_to_end(digest)
+                self.memory_hits += 1
+                return payload
+
+        payload = self._read_disk(digest)
+        if payload is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(digest, payload)
+        return payload
+
+    def put(self, key, result):
+        """Serialize a figure into both tiers, returns its JSON"""
+        digest = self.digest(key)
+        payload = self.serialize(result)
+        self._remember(digest, payload)
+        self._write_disk(digest, payload)
+        return payload
+
+    def get_or_render(self, key, render):
+        """JSON of a key, calling render() on a miss
+        Parameters:
+            key: tuple
+                -> method name, arguments and fingerprints of the inputs
+            render: callable
+                -> builds the figure (or a tuple holding figures)
+        """
+        payload = self.get(key)
+        if payload is not None:
+            return payload
+        with self._lock:
+            self.misses += 1
+        return self.put(key, render())
+
+    def stats(self):
+        """Hit and miss counters of both tiers"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+                "entries": len(self._memory),
+                "bytes": self._bytes
+            }
+
+    def clear(self):
+        """Empty the memory tier and the shared directory"""
+        with self._lock:
+            self._memory.clear()
+            self._bytes = 0
+        if self.disk_path is not None and self.disk_path.exists():
+            for path in self.disk_path.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def __repr__(self):
+        return f"FigureCache entries={len(self._memory)} disk_path={self.disk_path}"
+
+
+def lttb(x, y, n_out):
+    """Indices of n_out points keeping the visual shape of y against x
+    - Largest-Triangle-Three-Buckets: the sorted points are split into
+      buckets and each bucket keeps the point making the largest triangle
+      with the previously kept point and the mean of the next bucket
+    - The first and last points are always kept
+
+    Parameters:
+        x: numpy array
+            -> sorted x values
+        y: numpy array
+            -> y values, same length as x
+        n_out: int
+            -> number of points to keep
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges = np.append(edges, n)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = edges[i + 1], edges[i + 2]
+        cx, cy = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        area = np.abs(
+            (x[a] - cx) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (cy - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def scatter_data(df, x, value_vars, webgl_threshold=5_000, aggregate_threshold=50_000, max_points=5_000):
+    """Long frame for px.scatter plus the render mode for its size
+    - Up to webgl_threshold points the figure is drawn as SVG, above it
+      with WebGL (Scattergl)
+    - Above aggregate_threshold points every series is downsampled with
+      LTTB to max_points along x, so the browser gets a bounded payload
+
+    Parameters:
+        df: pandas DataFrame
+            -> one row per observation
+        x: str
+            -> x column
+        value_vars: list
+            -> y columns, one series (color) each
+    Returns:
+        (melted frame with x/Set/value columns, render mode, note for the title)
+    """
+    data = df[[x, *value_vars]].dropna()
+    points = len(data) * len(value_vars)
+    note = ""
+    if points > aggregate_threshold:
+        data = data.sort_values(x)
+        xs = data[x].to_numpy(dtype=float)
+        frames = []
+        for column in value_vars:
+            keep = lttb(xs, data[column].to_numpy(dtype=float), max_points)
+            frames.append(data.iloc[keep][[x, column]])
+        data = pd.concat(frames)
+        note = f" (downsampled from {points:,} points)"
+
+    data = data.melt(id_vars=x, value_vars=value_vars, var_name="Set", value_name="value").dropna()
+    render_mode = "webgl" if points > webgl_threshold else "svg"
+    return data, render_mode, note
+
+
+def histogram_figure(values, nbins, title, name):
+    """Histogram drawn from bin counts computed here
+    - The browser gets nbins bars instead of the raw values
+    """
+    values = np.asarray(values, dtype=float)
+    counts, edges = np.histogram(values[np.isfinite(values)], bins=nbins)
+    fig = go.Figure(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        width=np.diff(edges),
+        name=name,
+        showlegend=True,
+        customdata=np.column_stack([edges[:-1], edges[1:]]),
+        hovertemplate="%{customdata[0]:,.0f} - %{customdata[1]:,.0f}<br>count=%{y}<extra></extra>"
+    ))
+    fig.update_layout(title=title, bargap=0)
+    return fig
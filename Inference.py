@@ -0,0 +1,230 @@
+# Important libraries
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from Training import DTYPES
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def record_columns(records, columns):
+    """Raw house records (dicts in test.csv layout) as a dict of numpy columns
+    - Numerical columns become float arrays (NaN when missing or not a
+      number), the others object arrays with NaN for missing values
+
+    Parameters:
+        records: list
+            -> list of dicts
+        columns: list
+            -> raw columns to extract, eg. FeatureTransformer.selected_columns_
+    """
+    data = {}
+    for col in columns:
+        values = [record.get(col) for record in records]
+        if DTYPES.get(col, "object") != "object":
+            data[col] = np.array([_to_float(v) for v in values], dtype=float)
+        else:
+            data[col] = np.array([np.nan if v is None else v for v in values], dtype=object)
+    return data
+
+
+class CompiledPreprocessor:
+    """NumPy version of a fitted MakePipeline column transformer
+    - Numerical features: mean imputation and standard scaling from the
+      fitted statistics
+    - Categorical features: most frequent imputation and one-hot encoding
+      through a category -> output column lookup per feature; infrequent
+      and (if the encoder has them) unknown categories go to the
+      infrequent column
+    - Takes a dict of numpy columns instead of a DataFrame, so small
+      batches skip the pandas and estimator dispatch overhead
+
+    Parameters:
+        col_pipeline: ColumnTransformer
+            -> fitted `preprocess` step of a MakePipeline pipeline
+    """
+    def __init__(self, col_pipeline):
+        self.n_features = sum(
+            s.stop - s.start for s in col_pipeline.output_indices_.values()
+        )
+        self.numerical = []
+        self.categorical = []
+        for name, pipe, columns in col_pipeline.transformers_:
+            if pipe == "drop" or len(columns) == 0:
+                continue
+            out = col_pipeline.output_indices_[name]
+            steps = dict(pipe.steps) if isinstance(pipe, Pipeline) else {}
+            imputer, scaler, encoder = steps.get("imputer"), steps.get("scaler"), steps.get("encoder")
+
+            if isinstance(imputer, SimpleImputer) and isinstance(scaler, StandardScaler) and len(steps) == 2:
+                mean = scaler.mean_ if scaler.with_mean else np.zeros(len(columns))
+                scale = scaler.scale_ if scaler.with_std else np.ones(len(columns))
+                self.numerical.append((list(columns), imputer.statistics_.astype(float), mean, scale, out))
+            elif isinstance(imputer, SimpleImputer) and isinstance(encoder, OneHotEncoder) and len(steps) == 2:
+                if encoder.drop_idx_ is not None:
+                    raise ValueError("Cannot compile a OneHotEncoder with drop")
+                infrequent = getattr(encoder, "infrequent_categories_", None) or [None] * len(columns)
+                offset = out.start
+                for col, fill, categories, rare in zip(columns, imputer.statistics_, encoder.categories_, infrequent):
+                    # frequent categories keep their order, the infrequent
+                    # column comes last
+                    rare = set() if rare is None else set(rare)
+                    frequent = [category for category in categories if category not in rare]
+                    lookup = {category: offset + i for i, category in enumerate(frequent)}
+                    default = -1
+                    if rare:
+                        default = offset + len(frequent)
+                        lookup.update({category: default for category in rare})
+                        if encoder.handle_unknown != "infrequent_if_exist":
+                            default = -1
+                    self.categorical.append((col, fill, lookup, default))
+                    offset += len(frequent) + bool(rare)
+            else:
+                raise ValueError(f"Cannot compile the {name} transformer: {pipe}")
+
+    def transform(self, data):
+        """Dense feature matrix of a dict of numpy columns"""
+        n = len(next(iter(data.values())))
+        X = np.zeros((n, self.n_features))
+        for columns, fill, mean, scale, out in self.numerical:
+            values = np.column_stack([data[col] for col in columns]).astype(float)
+            values = np.where(np.isnan(values), fill, values)
+            X[:, out] = (values - mean) / scale
+
+        rows = np.arange(n)
+        for col, fill, lookup, default in self.categorical:
+            # missing values (NaN is the only value not equal to itself)
+            idx = np.fromiter(
+                (lookup.get(fill if v != v else v, default) for v in data[col]), dtype=np.intp, count=n
+            )
+            known = idx >= 0
+            X[rows[known], idx[known]] = 1.0
+        return X
+
+    def __repr__(self):
+        return f"CompiledPreprocessor n_features={self.n_features}"
+
+
+class CompiledTrees:
+    """Regression trees flattened into one set of node arrays
+    - Leaves point to themselves, so all trees are walked together, one
+      level per step, for every row at once
+
+    Parameters:
+        trees: list
+            -> fitted sklearn `Tree` objects (estimator.tree_)
+    """
+    def __init__(self, trees):
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])[:-1]
+        features, thresholds, lefts, rights, values = [], [], [], [], []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == -1
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(leaf, nodes, tree.children_left + offset))
+            rights.append(np.where(leaf, nodes, tree.children_right + offset))
+            values.append(tree.value[:, 0, 0])
+        self.roots = offsets
+        self.feature = np.concatenate(features)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts)
+        self.right = np.concatenate(rights)
+        self.value = np.concatenate(values)
+        self.depth = max(tree.max_depth for tree in trees)
+
+    def leaf_values(self, X):
+        """(rows, trees) leaf values of every tree"""
+        # sklearn compares float32 features against the thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return self.value[node]
+
+
+class CompiledPipeline:
+    """NumPy only scorer exported from a fitted MakePipeline pipeline
+    - CompiledPreprocessor for the column transformer
+    - LinearRegression: coefficients and intercept
+    - DecisionTree / RandomForest / GradientBoosting regressors: the trees
+      flattened into CompiledTrees
+    - Predictions match `pipeline.predict` (see tests/test_inference.py)
+
+    Parameters:
+        pipeline: Pipeline
+            -> fitted pipeline with a `preprocess` step and a model head
+    """
+    def __init__(self, pipeline):
+        self.preprocessor = CompiledPreprocessor(pipeline.named_steps["preprocess"])
+        head = pipeline.steps[-1][1]
+        self.head_name = type(head).__name__
+        self.coef = self.trees = None
+
+        if isinstance(head, LinearRegression):
+            self.coef = np.ravel(head.coef_)
+            self.intercept = float(np.ravel(head.intercept_)[0])
+        elif isinstance(head, DecisionTreeRegressor):
+            self.trees = CompiledTrees([head.tree_])
+            self.scale, self.intercept, self.combine = 1.0, 0.0, "mean"
+        elif isinstance(head, RandomForestRegressor):
+            self.trees = CompiledTrees([tree.tree_ for tree in head.estimators_])
+            self.scale, self.intercept, self.combine = 1.0, 0.0, "mean"
+        elif isinstance(head, GradientBoostingRegressor):
+            if head.init_ == "zero":
+                init = 0.0
+            elif hasattr(head.init_, "constant_"):
+                init = float(np.ravel(head.init_.constant_)[0])
+            else:
+                raise ValueError(f"Cannot compile the {head.init_} init estimator")
+            self.trees = CompiledTrees([tree.tree_ for tree in head.estimators_[:, 0]])
+            self.scale, self.intercept, self.combine = head.learning_rate, init, "sum"
+        else:
+            raise ValueError(f"Cannot compile a {self.head_name} model")
+
+    def predict_matrix(self, X):
+        """Predictions for an already preprocessed dense matrix"""
+        if self.coef is not None:
+            return X @ self.coef + self.intercept
+        leaves = self.trees.leaf_values(X)
+        combined = leaves.mean(axis=1) if self.combine == "mean" else leaves.sum(axis=1)
+        return self.intercept + self.scale * combined
+
+    def predict(self, data):
+        """Predictions for a dict of numpy columns, see FeatureTransformer.transform_columns"""
+        return self.predict_matrix(self.preprocessor.transform(data))
+
+    def __repr__(self):
+        return f"CompiledPipeline head={self.head_name} n_features={self.preprocessor.n_features}"
+
+
+class PipelinePredictor:
+    """CompiledPipeline interface for pipelines that cannot be compiled
+    - Builds a DataFrame from the columns and calls `pipeline.predict`
+
+    Parameters:
+        pipeline: Pipeline
+            -> fitted pipeline taking the FeatureTransformer output
+    """
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.head_name = type(pipeline.steps[-1][1]).__name__
+
+    def predict(self, data):
+        """Predictions for a dict of numpy columns, see FeatureTransformer.transform_columns"""
+        return self.pipeline.predict(pd.DataFrame(data))
+
+    def __repr__(self):
+        return f"PipelinePredictor head={self.head_name}"
@@ -0,0 +1,219 @@
+# Important libraries
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+
+class JobManager:
+    """Run long dashboard computations in a local process pool
+    - A job is identified by its function and arguments, submitting a job
+      that is already pending (or recently done) returns the same job id
+    - Status and results live in a SQLite file, so that any gunicorn
+      worker can answer a poll, no external broker is needed
+    - A pending job records the host and pid of the worker that runs it;
+      once that worker is gone the job is lost and the next submit
+      starts it again
+    - Every gunicorn worker starts its own pool, each pool process loads
+      the whole model stack, so the processes add up to workers x
+      max_workers; by default the pool shares the CPUs between the
+      WEB_CONCURRENCY workers
+
+    Parameters:
+        db_path: str/Path object
+            -> SQLite file holding the job table
+        max_workers: int/None
+            -> size of the process pool, by default the CPU count divided
+               by WEB_CONCURRENCY (at least 1)
+        result_ttl: int
+            -> seconds a finished result is served before it is recomputed
+        stale_after: int
+            -> seconds after which a pending job is considered lost even if
+               its owner cannot be checked (eg. it runs on another host)
+    """
+    def __init__(
+        self,
+        db_path = Path.cwd() / ".cache" / "jobs.sqlite",
+        max_workers = None,
+        result_ttl = 3600,
+        stale_after = 1800
+    ):
+        self.db_path = Path(db_path)
+        if max_workers is None:
+            web_workers = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+            max_workers = max(1, (os.cpu_count() or 1) // web_workers)
+        self.max_workers = max_workers
+        self.result_ttl = result_ttl
+        self.stale_after = stale_after
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    result BLOB,
+                    error TEXT,
+                    updated REAL NOT NULL,
+                    owner TEXT
+                )"""
+            )
+            columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                # job table of an older version
+                db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    @contextmanager
+    def _connect(self):
+        # autocommit mode, transactions are opened explicitly
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _pool(self):
+        """The process pool, started on first use"""
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded server process is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    @staticmethod
+    def job_id(func, *args, version=None):
+        """Id shared by every submission of the same function, arguments and version"""
+        name = f"{func.__module__}.{func.__qualname__}{args!r}{version!r}"
+        return hashlib.sha1(name.encode()).hexdigest()
+
+    @staticmethod
+    def _owner():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _is_lost(self, state, updated, owner, now):
+        """True for a pending job whose worker is gone or that ran too long"""
+        if state != "pending":
+            return False
+        if now - updated >= self.stale_after:
+            return True
+        host, _, pid = (owner or "").rpartition(":")
+        if host != socket.gethostname() or not pid.isdigit():
+            # another host, only the age tells
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def submit(self, func, *args, version=None):
+        """Queue func(*args) unless the same job is pending or done
+        Parameters:
+            func: callable
+                -> picklable function or bound method
+            args:
+                -> picklable arguments, their repr is part of the job id
+            version:
+                -> part of the job id only, eg. the fingerprint of the data
+                   and models, so that a change starts a new job instead of
+                   serving the old result
+        """
+        job_id = self.job_id(func, *args, version=version)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT state, updated, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None:
+                state, updated, owner = row
+                if state == "done" and now - updated < self.result_ttl:
+                    db.execute("COMMIT")
+                    return job_id
+                if state == "pending" and not self._is_lost(state, updated, owner, now):
+                    db.execute("COMMIT")
+                    return job_id
+            db.execute(
+                "INSERT OR REPLACE INTO jobs (id, state, result, error, updated, owner) "
+                "VALUES (?, 'pending', NULL, NULL, ?, ?)",
+                (job_id, now, self._owner())
+            )
+            # forget old results while we hold the write lock
+            db.execute("DELETE FROM jobs WHERE state != 'pending' AND updated < ?", (now - self.result_ttl,))
+            db.execute("COMMIT")
+
+        logging.info(f"Submitting job {job_id}: {func.__qualname__}{args!r}")
+        try:
+            future = self._pool().submit(func, *args)
+        except Exception as e:
+            self._record(job_id, "error", None, repr(e))
+            raise
+        future.add_done_callback(partial(self._finish, job_id))
+        return job_id
+
+    def _record(self, job_id, state, result, error):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                (state, result, error, time.time(), job_id)
+            )
+
+    def _finish(self, job_id, future):
+        """Record the outcome of a job"""
+        try:
+            row = ("done", pickle.dumps(future.result()), None)
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed")
+            row = ("error", None, repr(e))
+            if isinstance(e, BrokenProcessPool):
+                # a pool process died, start a fresh pool on the next submit
+                with self._lock:
+                    self._executor = None
+        self._record(job_id, *row)
+
+    def status(self, job_id):
+        """State of a job: pending, done, error, lost or None if unknown"""
+        with self._connect() as db:
+            row = db.execute("SELECT state, updated, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if self._is_lost(*row, time.time()):
+            return "lost"
+        return row[0]
+
+    def result(self, job_id):
+        """Result of a finished job, raises RuntimeError if it failed"""
+        with self._connect() as db:
+            row = db.execute("SELECT state, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] == "pending":
+            raise RuntimeError(f"Job {job_id} has not finished")
+        state, result, error = row
+        if state == "error":
+            raise RuntimeError(f"Job {job_id} failed: {error}")
+        return pickle.loads(result)
+
+    def shutdown(self):
+        """Stop the process pool"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def __repr__(self):
+        return f"JobManager db_path={self.db_path} max_workers={self.max_workers}"
@@ -0,0 +1,223 @@
+# Important libraries
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import ContextDecorator
+
+# seconds, from a cached figure to a forest fit on a large file
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Counter:
+    """Monotonic counter, one value per label set
+    Parameters:
+        name: str
+            -> metric name, eg. `amos_model_fits_total`
+        help: str
+            -> description shown by Prometheus
+        labelnames: tuple
+            -> names of the labels passed to `inc`
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) of every series"""
+        with self._lock:
+            return [("", key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Counter):
+    """Distribution of observed values (eg. seconds) over fixed buckets
+    Parameters:
+        buckets: tuple
+            -> sorted upper bounds, `+Inf` is added
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def value(self, **labels):
+        """(observation count, sum) of a label set"""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts), total
+
+    def samples(self):
+        rows = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float("inf")), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    rows.append(("_bucket", key, (("le", le),), cumulative))
+                rows.append(("_sum", key, (), total))
+                rows.append(("_count", key, (), cumulative))
+        return rows
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """Counters and histograms of one process, rendered for Prometheus
+    - Metrics are created on first use, asking again for the same name
+      returns the same metric
+    - Every gunicorn worker (and job process) keeps its own values, the
+      `/metrics` route reports the worker answering the scrape
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(f"{name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help="", labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help="", labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self, extra=()):
+        """Prometheus text exposition format (version 0.0.4)
+        Parameters:
+            extra: iterable
+                -> more metrics (eg. built from cache stats) to render
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in (*metrics, *extra):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, extra_labels, value in metric.samples():
+                labels = (*zip(metric.labelnames, key), *extra_labels)
+                label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {float(value)!r}" if labels
+                             else f"{metric.name}{suffix} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def __repr__(self):
+        return f"MetricsRegistry metrics={len(self._metrics)}"
+
+
+# Process wide metrics
+METRICS = MetricsRegistry()
+
+
+class timed(ContextDecorator):
+    """Record the seconds of a block (or function) in a histogram
+    - Usable as `with timed(...):` or as a `@timed(...)` decorator
+    - The seconds are observed even when the block raises
+
+    Parameters:
+        name: str
+            -> histogram name, eg. `amos_wrangle_stage_seconds`
+        help: str
+            -> description shown by Prometheus
+        labels:
+            -> label values, eg. stage="basic"
+    """
+    def __init__(self, name, help="", **labels):
+        self.histogram = METRICS.histogram(name, help, tuple(labels))
+        self.labels = labels
+        self.seconds = None
+
+    def _recreate_cm(self):
+        # a fresh timer per decorated call, calls may overlap in threads
+        return timed(self.histogram.name, self.histogram.help, **self.labels)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._start
+        self.histogram.observe(self.seconds, **self.labels)
+        return False
+
+
+def count(name, amount=1, help="", **labels):
+    """Add to a counter, creating it on first use"""
+    METRICS.counter(name, help, tuple(labels)).inc(amount, **labels)
+
+
+# Trace ids, set for each web request and added to every log record
+_TRACE_ID = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id(trace_id=None):
+    """Start a trace, returns the token that `end_trace` resets"""
+    return _TRACE_ID.set(trace_id or uuid.uuid4().hex[:16])
+
+def end_trace(token):
+    _TRACE_ID.reset(token)
+
+def current_trace_id():
+    return _TRACE_ID.get()
+
+
+class TraceIdFilter(logging.Filter):
+    """Add the trace id of the current request to log records (`%(trace_id)s`)"""
+    def filter(self, record):
+        record.trace_id = _TRACE_ID.get()
+        return True
+
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"
+
+def install_trace_logging(level=logging.INFO, fmt=LOG_FORMAT):
+    """Log through the root logger with the trace id of each record
+    - The `logging.info` calls of Training.py and the other modules go
+      through the root logger, so they all carry the request trace id
+    """
+    root = logging.getLogger()
+    if not root.handlers:
+        logging.basicConfig(level=level)
+    root.setLevel(level)
+    for handler in root.handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter(fmt))
@@ -1,14 +1,34 @@
 import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, State, ctx
-from Business import GraphBuilder, MapId
+from dash import dcc, html, Input, Output, State, ctx, Patch, no_update
+from Business import GraphBuilder, MapId, model_registry, figure_cache, figure_fingerprint
+from Jobs import JobManager
+from Api import register_api, register_cache_stats, register_metrics
+from Metrics import install_trace_logging
+from Profiling import register_profiling
 import pandas as pd
 import plotly.graph_objects as go
 from dash.exceptions import PreventUpdate
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# page content is created by callbacks, so its ids are not in the initial layout
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+                suppress_callback_exceptions=True)
 server = app.server
 
+# JSON prediction endpoint, POST /predict
+register_api(server, model_registry)
+# figure cache hit/miss counters, GET /cache/stats
+register_cache_stats(server, {"figures": figure_cache})
+# timings and counters in Prometheus format, GET /metrics
+register_metrics(server, {"figures": figure_cache})
+# log records carry the trace id of their request
+install_trace_logging()
+# cProfile/tracemalloc reports with AMOS_PROFILE, or ?profile=1 and GET /admin/profiles with AMOS_ADMIN_TOKEN
+register_profiling(server)
+
+# long computations (learning curves, submissions) run outside the request
+jobs = JobManager()
+
 # Layout definition
 def create_layout():
     return html.Div([
@@ -30,11 +50,15 @@ def create_layout():
                 dbc.Input(id="id-label", placeholder="Enter label for submission file", type="text"),
                 dbc.Button("Generate Submission", id="download-button", color="success", className="mt-2 w-100"),
                 dcc.Download(id="download-component"),
+                dcc.Store(id="download-job"),
+                dcc.Interval(id="download-poll", interval=1000, disabled=True),
                 html.Div(id="download-message", className="text-success mt-2")
             ])
         ], className="side-bar", id="sidebar"),
 
         html.Div([
+            # figures already rendered in this browser, keyed by "page:tab"
+            dcc.Store(id="figure-store", data={}, storage_type="memory"),
             html.Div(id="main-content"),
             dcc.Loading(
                 id="loading-output",
@@ -62,6 +86,117 @@ def toggle_sidebar(n, className):
             return "side-bar active"
     return className
 
+# figures come as plain dicts from the figure cache, Dash sends them as is
+def graphs():
+    return GraphBuilder(as_dict=True)
+
+# Model pages: one figure per model tab, built only when its tab is opened
+def residual_figure(model_type):
+    if model_type == "linear":
+        return graphs().residual_plot()
+    return graphs().residual_tree_plot(model_type)[1]
+
+page_figures = {
+    "lc": lambda model_type: getattr(graphs(), f"learning_curve_{model_type}")(),
+    "fi": lambda model_type: graphs().feature_importance(model_type),
+    "predictions": lambda model_type: graphs().scatter_plot(model_type),
+    "residual": residual_figure
+}
+
+def model_tabs(page, title, first_label="Linear"):
+    """Tabs of a model page, the graph is filled by the tab callbacks"""
+    labels = {
+        "linear": first_label,
+        "tree": "Decision Tree",
+        "forest": "Random Forest",
+        "gradient": "Gradient Boosting"
+    }
+    return html.Div([
+        html.H5(title, className="text-center mb-4"),
+        dcc.Store(id="page-store", data=page),
+        dcc.Store(id="figure-request"),
+        dcc.Store(id="figure-job"),
+        dcc.Interval(id="figure-poll", interval=1000, disabled=True),
+        dbc.Tabs([dbc.Tab(label=label, tab_id=model_type) for model_type, label in labels.items()],
+                 id="model-tabs", active_tab="linear"),
+        dcc.Loading(dcc.Graph(id="model-graph"), type="circle")
+    ])
+
+# Serve a tab from the browser store, only ask the server on a miss
+app.clientside_callback(
+    """
+    function(tab, page, figures) {
+        const key = page + ":" + tab;
+        if (figures && figures[key]) {
+            return [figures[key], window.dash_clientside.no_update];
+        }
+        return [window.dash_clientside.no_update, {"page": page, "tab": tab}];
+    }
+    """,
+    Output("model-graph", "figure"),
+    Output("figure-request", "data"),
+    Input("model-tabs", "active_tab"),
+    State("page-store", "data"),
+    State("figure-store", "data")
+)
+
+@app.callback(
+    Output("model-graph", "figure", allow_duplicate=True),
+    Output("figure-store", "data"),
+    Output("figure-job", "data"),
+    Output("figure-poll", "disabled"),
+    Input("figure-request", "data"),
+    State("model-tabs", "active_tab"),
+    prevent_initial_call=True
+)
+def render_tab_figure(request, active_tab):
+    if not request:
+        raise PreventUpdate
+
+    # learning curves take long, they are computed by a background job
+    # unless a worker already put them in the figure cache
+    if request["page"] == "lc":
+        fig = graphs().peek(f"learning_curve_{request['tab']}")
+        if fig is not None:
+            return (*store_figure(request, fig, active_tab), no_update, no_update)
+        # a change of data, params or code starts a new job
+        job_id = jobs.submit(getattr(graphs(), f"learning_curve_{request['tab']}"), version=figure_fingerprint())
+        return no_update, no_update, {**request, "job_id": job_id}, False
+
+    fig = page_figures[request["page"]](request["tab"])
+    return (*store_figure(request, fig, active_tab), no_update, no_update)
+
+def store_figure(request, fig, active_tab):
+    """Outputs showing a figure and adding it to the browser store"""
+    # add only this figure to the store instead of sending the whole store
+    figures = Patch()
+    figures[f"{request['page']}:{request['tab']}"] = fig
+
+    # the user may have switched tabs while the figure was computed
+    if request["tab"] != active_tab:
+        return no_update, figures
+    return fig, figures
+
+@app.callback(
+    Output("model-graph", "figure", allow_duplicate=True),
+    Output("figure-store", "data", allow_duplicate=True),
+    Output("figure-poll", "disabled", allow_duplicate=True),
+    Input("figure-poll", "n_intervals"),
+    State("figure-job", "data"),
+    State("model-tabs", "active_tab"),
+    prevent_initial_call=True
+)
+def poll_tab_figure(n, job, active_tab):
+    if not job:
+        raise PreventUpdate
+    state = jobs.status(job["job_id"])
+    if state == "pending":
+        raise PreventUpdate
+    if state == "done":
+        return (*store_figure(job, jobs.result(job["job_id"]), active_tab), True)
+    # failed or lost, the next visit of the tab submits the job again
+    return go.Figure(layout={"title": "Could not compute the learning curve, try again."}), no_update, True
+
 # Routing logic
 @app.callback(
     Output("plots-container", "children"),
@@ -78,53 +213,21 @@ def render_content(home, lc, fi, predictions, residual, about):
     if triggered == "btn-home":
         return html.Div([
             html.H5("Quick EDA", className="text-center mb-4"),
-            dbc.Row([dbc.Col(dcc.Graph(figure=GraphBuilder().house_price_hist()), width=12)]),
-            dbc.Row([dbc.Col(dcc.Graph(figure=GraphBuilder().pca_plot()), width=12)])
+            dbc.Row([dbc.Col(dcc.Graph(figure=graphs().house_price_hist()), width=12)]),
+            dbc.Row([dbc.Col(dcc.Graph(figure=graphs().pca_plot()), width=12)])
         ])
 
     elif triggered == "btn-lc":
-        return html.Div([
-            html.H5("Training and Validation Learning Curves", className="text-center mb-4"),
-            dbc.Tabs([
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().learning_curve_linear()), label="Linear Model"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().learning_curve_tree()), label="Decision Tree"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().learning_curve_forest()), label="Random Forest"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().learning_curve_gradient()), label="Gradient Boosting")
-            ])
-        ])
+        return model_tabs("lc", "Training and Validation Learning Curves", first_label="Linear Model")
 
     elif triggered == "btn-fi":
-        return html.Div([
-            html.H5("Feature Importance & Performance Analysis", className="text-center mb-4"),
-            dbc.Tabs([
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().feature_importance("linear")), label="Linear"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().feature_importance("tree")), label="Decision Tree"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().feature_importance("forest")), label="Random Forest"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().feature_importance("gradient")), label="Gradient Boosting")
-            ])
-        ])
+        return model_tabs("fi", "Feature Importance & Performance Analysis")
 
     elif triggered == "btn-predictions":
-        return html.Div([
-            html.H5("Prediction Scatter Plots", className="text-center mb-4"),
-            dbc.Tabs([
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().scatter_plot("linear")), label="Linear"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().scatter_plot("tree")), label="Decision Tree"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().scatter_plot("forest")), label="Random Forest"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().scatter_plot("gradient")), label="Gradient Boosting")
-            ])
-        ])
+        return model_tabs("predictions", "Prediction Scatter Plots")
 
     elif triggered == "btn-residual":
-        return html.Div([
-            html.H5("Residual Plots", className="text-center mb-4"),
-            dbc.Tabs([
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().residual_plot()), label="Linear"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().residual_tree_plot("tree")[1]), label="Decision Tree"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().residual_tree_plot("forest")[1]), label="Random Forest"),
-                dbc.Tab(dcc.Graph(figure=GraphBuilder().residual_tree_plot("gradient")[1]), label="Gradient Boosting")
-            ])
-        ])
+        return model_tabs("residual", "Residual Plots")
 
     elif triggered == "btn-about":
         return html.Div([
@@ -147,7 +250,8 @@ def render_content(home, lc, fi, predictions, residual, about):
 
 # Handle submission download
 @app.callback(
-    [Output("download-component", "data"),
+    [Output("download-job", "data"),
+     Output("download-poll", "disabled"),
      Output("download-message", "children")],
     [Input("download-button", "n_clicks")],
     [State("id-label", "value")]
@@ -155,5 +259,25 @@ def render_content(home, lc, fi, predictions, residual, about):
 def download_submission(n, label):
     if not n or not label:
         raise PreventUpdate
-    df = MapId().get_id(label)
-    return dcc.send_data_frame(df.to_csv, filename=f"{label}_submission.csv"), "Your CSV file is ready. Click the download button again to save."
+    job_id = jobs.submit(MapId().get_id, label, version=figure_fingerprint())
+    return {"job_id": job_id, "label": label}, False, "Generating your submission..."
+
+@app.callback(
+    [Output("download-component", "data"),
+     Output("download-message", "children", allow_duplicate=True),
+     Output("download-poll", "disabled", allow_duplicate=True)],
+    [Input("download-poll", "n_intervals")],
+    [State("download-job", "data")],
+    prevent_initial_call=True
+)
+def poll_submission(n, job):
+    if not job:
+        raise PreventUpdate
+    state = jobs.status(job["job_id"])
+    if state == "pending":
+        raise PreventUpdate
+    if state != "done":
+        return no_update, "Could not generate the submission, please try again.", True
+    df = jobs.result(job["job_id"])
+    label = job["label"]
+    return dcc.send_data_frame(df.to_csv, filename=f"{label}_submission.csv"), "Your CSV file is ready. Click the download button again to save.", True
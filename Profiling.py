@@ -0,0 +1,265 @@
+# Important libraries
+import cProfile
+import functools
+import hashlib
+import hmac
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from flask import abort, g, jsonify, request, send_from_directory
+
+from Metrics import current_trace_id
+
+
+class Profiler:
+    """Opt-in cProfile and tracemalloc reports of single calls
+    - `profile(name)` writes `<stamp>-<name>-<trace id>.pstats` (open with
+      `python -m pstats` or snakeviz) and a `.txt` file with the top
+      functions and the top allocations made during the call
+    - Only the newest max_reports reports are kept in report_dir
+    - Nested profiles are ignored, the outer report covers them; the
+      allocations are traced process wide, so concurrent requests show up
+      in each other's allocation report and peak
+
+    Parameters:
+        report_dir: str/Path object
+            -> directory of the reports
+        max_reports: int
+            -> reports kept, the oldest are removed
+        enabled: bool/None
+            -> profile every wrapped call, by default the AMOS_PROFILE env
+               variable; otherwise only requests asking for it are profiled
+        top: int
+            -> functions and allocation lines listed in the text report
+    """
+    def __init__(
+        self,
+        report_dir = Path.cwd() / ".cache" / "profiles",
+        max_reports = 50,
+        enabled = None,
+        top = 30
+    ):
+        self.report_dir = Path(report_dir)
+        self.max_reports = max_reports
+        if enabled is None:
+            enabled = os.environ.get("AMOS_PROFILE", "").lower() in ("1", "true", "yes")
+        self.enabled = enabled
+        self.top = top
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = 0
+        self._owns_tracing = False
+
+    @property
+    def active(self):
+        """True while this thread is inside a profile"""
+        return getattr(self._local, "active", False)
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracing = True
+            elif self._tracing == 0:
+                self._owns_tracing = False
+            self._tracing += 1
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._owns_tracing:
+                tracemalloc.stop()
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the block and write its report
+        Parameters:
+            name: str
+                -> what is profiled, eg. the callback output, part of the
+                   report file name
+        """
+        if self.active:
+            yield None
+            return
+
+        self._local.active = True
+        self._start_tracing()
+        # the peak of this call, not of whatever was traced before
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                yield profiler
+            finally:
+                profiler.disable()
+            seconds = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            self._write_report(name, profiler, before, after, seconds, peak)
+        finally:
+            self._stop_tracing()
+            self._local.active = False
+
+    def profiled(self, name=None):
+        """Decorator profiling a function when profiling is enabled"""
+        def decorator(func):
+            label = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or self.active:
+                    return func(*args, **kwargs)
+                with self.profile(label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _write_report(self, name, profiler, before, after, seconds, peak):
+        try:
+            self.report_dir.mkdir(parents=True, exist_ok=True)
+            safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")[:80]
+            stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_name}-{current_trace_id()}"
+
+            profiler.dump_stats(self.report_dir / f"{stem}.pstats")
+
+            text = io.StringIO()
+            text.write(f"{name}: {seconds:.3f}s, traced memory peak {peak / 2**20:.1f} MB\n\n")
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(self.top)
+            text.write("Top allocations during the call (size, count):\n")
+            for stat in after.compare_to(before, "lineno")[:self.top]:
+                text.write(f"{stat}\n")
+            (self.report_dir / f"{stem}.txt").write_text(text.getvalue())
+            logging.info(f"Profiled {name} in {seconds:.3f}s, report {stem}")
+        except OSError:
+            logging.exception("Could not write the profile report")
+            return
+        self.rotate()
+
+    def reports(self):
+        """Stored reports, newest first"""
+        if not self.report_dir.exists():
+            return []
+        rows = []
+        for path in self.report_dir.glob("*.txt"):
+            stat = path.stat()
+            rows.append({
+                "name": path.stem,
+                "created": stat.st_mtime,
+                "files": [p.name for p in (path, path.with_suffix(".pstats")) if p.exists()]
+            })
+        return sorted(rows, key=lambda row: row["created"], reverse=True)
+
+    def rotate(self):
+        """Remove the oldest reports beyond max_reports"""
+        for row in self.reports()[self.max_reports:]:
+            for file_name in row["files"]:
+                (self.report_dir / file_name).unlink(missing_ok=True)
+
+    def __repr__(self):
+        return f"Profiler report_dir={self.report_dir} enabled={self.enabled}"
+
+
+# Process wide profiler
+PROFILER = Profiler()
+
+
+def register_profiling(server, profiler=PROFILER, token=None):
+    """Profile Dash callbacks on demand and serve the reports
+    - With AMOS_PROFILE set every callback request is profiled
+    - The rest needs a token (`?token=` or `X-Admin-Token`), without one
+      only AMOS_PROFILE works and the reports stay on disk (local runs):
+    - `?profile=1&token=...` on the page sets a cookie, derived from the
+      token, so that the callbacks of that browser are profiled,
+      `?profile=0` removes it; a request can also ask with `?profile=1`
+      or the `X-Profile: 1` header plus the token
+    - GET /admin/profiles lists the reports, /admin/profiles/<file>
+      downloads one
+
+    Parameters:
+        server: flask.Flask
+            -> the server behind the Dash app
+        profiler: Profiler
+            -> where the reports are written
+        token: str/None
+            -> required as `?token=` or `X-Admin-Token` by the admin
+               routes and the profile triggers, by default the
+               AMOS_ADMIN_TOKEN env variable; without it they are off
+    Returns the list view function, None without a token
+    """
+    token = token if token is not None else os.environ.get("AMOS_ADMIN_TOKEN")
+    # cookie value, only handed out to requests holding the token
+    cookie_value = hmac.new(token.encode(), b"amos_profile", hashlib.sha256).hexdigest() if token else None
+
+    def has_token():
+        if not token:
+            return False
+        given = request.args.get("token") or request.headers.get("X-Admin-Token") or ""
+        return hmac.compare_digest(given.encode(), token.encode())
+
+    def wants_profile():
+        if request.path.startswith(("/admin/", "/metrics")):
+            return False
+        if profiler.enabled and request.path.endswith("_dash-update-component"):
+            return True
+        if not token:
+            return False
+        if request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1":
+            return has_token()
+        return hmac.compare_digest(request.cookies.get("amos_profile", "").encode(), cookie_value.encode())
+
+    @server.before_request
+    def start_profile():
+        if not wants_profile():
+            return
+        name = request.path
+        if name.endswith("_dash-update-component"):
+            # the callback is identified by its outputs
+            payload = request.get_json(silent=True) or {}
+            name = payload.get("output", name)
+        g.profile = profiler.profile(name)
+        g.profile.__enter__()
+
+    @server.teardown_request
+    def finish_profile(exc):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            profile.__exit__(None, None, None)
+
+    if not token:
+        logging.info("No AMOS_ADMIN_TOKEN, the profile triggers and /admin/profiles are off")
+        return None
+
+    @server.after_request
+    def set_profile_cookie(response):
+        if request.args.get("profile") == "1" and has_token():
+            response.set_cookie("amos_profile", cookie_value, max_age=3600, httponly=True, samesite="Strict")
+        elif request.args.get("profile") == "0":
+            response.delete_cookie("amos_profile")
+        return response
+
+    def check_token():
+        if not has_token():
+            abort(403)
+
+    @server.route("/admin/profiles", methods=["GET"])
+    def list_profiles():
+        check_token()
+        return jsonify(profiles=profiler.reports())
+
+    @server.route("/admin/profiles/<path:file_name>", methods=["GET"])
+    def get_profile(file_name):
+        check_token()
+        return send_from_directory(profiler.report_dir.resolve(), file_name, as_attachment=True)
+
+    return list_profiles
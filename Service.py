@@ -1,5 +1,18 @@
-from Training import WrangleRepository, MakePipeline, LearningCurve
+from Training import WrangleRepository, MakePipeline, LearningCurve, FeatureTransformer, frame_fingerprint
 from pathlib import Path
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.inspection import permutation_importance
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
 
 # defining sub class
 sub_class = {
@@ -22,6 +35,15 @@ sub_class = {
 
 }
 
+# 1-D PCA projections shared by every plot, keyed by data fingerprint and method
+_PROJECTIONS = OrderedDict()
+_PROJECTIONS_LOCK = threading.Lock()
+_PROJECTIONS_SIZE = 8
+
+# matrix sizes (rows x columns) above which the cheaper PCA fits are used
+PCA_RANDOMIZED_SIZE = 5_000_000
+PCA_INCREMENTAL_SIZE = 50_000_000
+
 
 class GetData:
     """Help us organize our data nicely
@@ -58,12 +80,22 @@ class GetData:
         self.repo.feature_engineering()
         df = self.repo.get_data("engineered")
 
-        # remove outliers in our data
-        self.repo.remove_outliers()
+        # remove outliers in our data, only the house age is checked so that
+        # the models keep the training rows they were tuned on
+        self.repo.remove_outliers(columns=["HouseAge"])
         df = self.repo.get_data() 
         
         return df, df_raw
         
+    def feature_transformer(self):
+        """Wrangling learned on the training data, to apply on new rows"""
+        if self.repo.stage_columns("engineered") is None:
+            self.training_data()
+        transformer = FeatureTransformer().fit(self.repo)
+
+        self.transformer = transformer
+        return transformer
+
     def get_sale_price(self):
         """From the raw data we get the sale price data"""
         self.repo.basic_cleaning()
@@ -75,18 +107,60 @@ class GetData:
         return sale_price
 
 
-    def _make_pca(self):
+    def _make_pca(self, method="full"):
         """Get feature decomposed pipeline"""
         pipe = self.pipe 
-        pca_pipeline = pipe.make_pca_pipeline()
+        pca_pipeline = pipe.make_pca_pipeline(method=method)
 
         self.pca_pipeline = pca_pipeline
         return pca_pipeline
 
-    def get_pca_data(self):
-        """Get the decompoese features data"""
-        pca_pipeline = self._make_pca()
-        pca_data = pca_pipeline.fit_transform(self.X_train)
+    @staticmethod
+    def pca_method(Xt):
+        """PCA fit for the size of the matrix: full, randomized, incremental
+        or truncated
+        - Sparse matrices are never densified: full fits them with implicit
+          centering (covariance_eigh/arpack), large ones use TruncatedSVD
+        """
+        size = Xt.shape[0] * Xt.shape[1]
+        if sparse.issparse(Xt):
+            return "truncated" if size > PCA_RANDOMIZED_SIZE else "full"
+        if size > PCA_INCREMENTAL_SIZE:
+            return "incremental"
+        if size > PCA_RANDOMIZED_SIZE:
+            return "randomized"
+        return "full"
+
+    def get_pca_data(self, method="auto"):
+        """Get the decompoese features data
+        - The projection is fitted once per X_train content and shared by
+          every plot, treat the returned array as read only
+
+        Parameters:
+            method: str
+                -> auto picks from the matrix size, or one of full,
+                   randomized (dense matrices only), incremental, truncated
+                   (see MakePipeline.make_pca_pipeline)
+        """
+        key = (frame_fingerprint(self.X_train), self.pipe.sparse, method)
+        with _PROJECTIONS_LOCK:
+            if key in _PROJECTIONS:
+                _PROJECTIONS.move_to_end(key)
+                self.pca_pipeline, pca_data = _PROJECTIONS[key]
+                self.pca_data = pca_data
+                return pca_data
+
+            # PCA trains on the shared preprocessed matrix of X_train
+            col_pipeline, Xt = self.pipe.preprocess()
+            if method == "auto":
+                method = self.pca_method(Xt)
+            logging.info(f"Fitting the {method} PCA projection")
+            pca_pipeline = self.pipe.fit_shared(self._make_pca(method=method))
+            pca_data = pca_pipeline.named_steps["PCA Algorithm"].transform(Xt)
+            pca_data.flags.writeable = False
+            _PROJECTIONS[key] = (pca_pipeline, pca_data)
+            if len(_PROJECTIONS) > _PROJECTIONS_SIZE:
+                _PROJECTIONS.popitem(last=False)
 
         self.pca_data = pca_data
         return pca_data
@@ -167,34 +241,114 @@ class IDMapping:
         """Initialization for Mapping"""
         # Getting the repo
         self.repo = WrangleRepository(file_name = "test.csv", sub_class = sub_class)
-    def get_test_data(self):
-        # Getting the csv data
-        self.repo.wrangle()
-        df = self.repo.get_data("wrangled")
-        
-        # basic cleaning (no)
-        self.repo.basic_cleaning(clean=False)
-        df = self.repo.get_data("basic")
+    def get_test_data(self, transformer=None):
+        """Test rows wrangled the way the training rows were
+        Parameters:
+            transformer: FeatureTransformer
+                -> fitted on the training data, fitted here if not given
+        """
+        if transformer is None:
+            transformer = GetData().feature_transformer()
 
-        # feature selction (n0)
-        self.repo.feature_selection(variance_selector=False)
-        df = self.repo.get_data("selected")
-        
-        # feature engineering 
-        self.repo.feature_engineering()
-        df = self.repo.get_data("engineered")
+        # Getting the csv data
+        df = self.repo.wrangle()
 
-        # final mapping 
-        df, df_raw = GetData(). training_data()# Get the trainingdata
-        X_train = df.drop(columns = "SalePrice") # Make the training feature matrix
-        df_test = df[X_train.columns]
+        # dropped, selected and engineered features, as learned on train
+        df_test = transformer.transform(df)
 
         return df_test
 
 
+class FeatureImportance:
+    """Feature importances of a fitted pipeline, per source column
+    - One-hot dummies are summed back into the column they encode with a
+      precomputed map of output -> source column (np.add.reduceat over
+      the contiguous output blocks of every column)
+    - Permutation importance refits the pipeline on a training split and
+      shuffles the raw columns of the held-out split, in parallel
 
-
-
-
-
-
+    Parameters:
+        model: Pipeline
+            -> fitted pipeline with a `preprocess` column transformer step
+        X: pd.DataFrame
+            -> feature matrix the pipeline was trained on
+        y: pd.Series
+            -> target
+    """
+    def __init__(self, model, X, y):
+        self.model = model
+        self.X = X
+        self.y = y
+
+    def source_map(self):
+        """(source columns, start of every column in the preprocessed output)"""
+        col_pipeline = self.model.named_steps["preprocess"]
+        columns, starts = [], []
+        for name, pipe, source in col_pipeline.transformers_:
+            out = col_pipeline.output_indices_.get(name)
+            if out is None or out.stop == out.start:
+                continue
+            encoder = pipe.named_steps.get("encoder") if isinstance(pipe, Pipeline) else None
+            if isinstance(encoder, OneHotEncoder):
+                widths = []
+                for i, categories in enumerate(encoder.categories_):
+                    width = len(categories)
+                    if getattr(encoder, "infrequent_categories_", None) is not None \
+                            and encoder.infrequent_categories_[i] is not None:
+                        width -= len(encoder.infrequent_categories_[i]) - 1
+                    if encoder.drop_idx_ is not None and encoder.drop_idx_[i] is not None:
+                        width -= 1
+                    widths.append(width)
+            else:
+                widths = [1] * len(source)
+            if sum(widths) != out.stop - out.start:
+                raise ValueError(f"Cannot map the {name} outputs back to their columns")
+            columns += list(source)
+            starts += list(out.start + np.cumsum([0] + widths[:-1]))
+        return columns, np.asarray(starts)
+
+    def native(self):
+        """Importances stored by the model head, summed per source column
+        - linear models: std over the rows of X of each column's share of
+          the prediction (its dummies' coefficients times their values).
+          Unlike summed |coef| this does not depend on the arbitrary
+          offset of the coefficients of a full set of one-hot dummies
+        """
+        head = self.model.steps[-1][1]
+        columns, starts = self.source_map()
+        if hasattr(head, "feature_importances_"):
+            values = np.add.reduceat(head.feature_importances_, starts)
+        elif hasattr(head, "coef_"):
+            values = self.contribution_std(np.ravel(head.coef_), starts)
+        else:
+            raise ValueError(f"{type(head).__name__} has no native importances, use permutation")
+        return pd.Series(values, index=columns, name="feature importance")
+
+    def contribution_std(self, coef, starts):
+        """Std over the rows of X of every source column's contribution to a linear prediction"""
+        Xt = self.model.named_steps["preprocess"].transform(self.X)
+        # output -> source column indicator, (outputs, columns)
+        widths = np.diff(np.append(starts, len(coef)))
+        block = np.repeat(np.arange(len(starts)), widths)
+        indicator = sparse.csr_matrix((coef, (np.arange(len(coef)), block)), shape=(len(coef), len(starts)))
+        contributions = Xt @ indicator
+        if sparse.issparse(contributions):
+            contributions = contributions.toarray()
+        return np.asarray(contributions).std(axis=0)
+
+    def permutation(self, n_repeats=5, test_size=0.2, n_jobs=None, random_state=42):
+        """Mean drop of the held-out R2 when a raw column is shuffled"""
+        X_train, X_val, y_train, y_val = train_test_split(
+            self.X, self.y, test_size=test_size, random_state=random_state
+        )
+        model = clone(self.model).fit(X_train, y_train)
+        result = permutation_importance(
+            model, X_val, y_val,
+            n_repeats=n_repeats,
+            n_jobs=n_jobs if n_jobs is not None else min(4, os.cpu_count() or 1),
+            random_state=random_state
+        )
+        return pd.Series(result.importances_mean, index=self.X.columns, name="feature importance")
+
+    def __repr__(self):
+        return f"FeatureImportance head={type(self.model.steps[-1][1]).__name__}"
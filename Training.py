@@ -3,53 +3,520 @@ import pandas as pd
 import math 
 import numpy as np 
 import logging 
+import hashlib
+import json
+import os
+import threading
+import time
+import resource
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import plotly.express as px
+import joblib
+from joblib import Parallel, delayed
+
+from Metrics import count, timed
 
 from sklearn.feature_selection import VarianceThreshold
-from sklearn.model_selection import learning_curve 
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+from sklearn.model_selection import RepeatedKFold
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline  
 from sklearn.compose import ColumnTransformer
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA, TruncatedSVD
 from sklearn.linear_model import LinearRegression
 from sklearn.tree import DecisionTreeRegressor
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
+
+# Model hyperparameters, one entry per model type
+MODEL_PARAMS = {
+    "linear": {},
+    "tree": {
+        "random_state": 42,
+        "min_samples_leaf": 1,
+        "min_samples_split": 6,
+        "max_depth": 7
+    },
+    "forest": {
+        "random_state": 42,
+        "n_estimators": 60,
+        "min_samples_leaf": 1,
+        "min_samples_split": 4,
+        "max_depth": 10
+    },
+    "gradient": {
+        "backend": "exact",
+        "random_state": 42,
+        "n_estimators": 100,
+        "min_samples_leaf": 1,
+        "min_samples_split": 3,
+        "max_depth": 2
+    }
+}
+
+# Gradient boosting engines, picked with AMOS_GRADIENT_BACKEND:
+# - exact: GradientBoostingRegressor on the shared one-hot matrix
+# - hist: HistGradientBoostingRegressor, binned features with native
+#   categorical splits (no one-hot encoding) and early stopping
+GRADIENT_PARAMS = {
+    "exact": MODEL_PARAMS["gradient"],
+    "hist": {
+        "backend": "hist",
+        "random_state": 42,
+        "max_iter": 1000,
+        "learning_rate": 0.1,
+        "max_leaf_nodes": 7,
+        "min_samples_leaf": 5,
+        "l2_regularization": 0.0,
+        "early_stopping": True,
+        "validation_fraction": 0.1,
+        "n_iter_no_change": 20
+    }
+}
+
+# Sparse preprocessing, turned on with AMOS_SPARSE_PREPROCESS=1:
+# - the column transformer always outputs a CSR matrix, whatever its density
+# - categories seen fewer than min_frequency times, and those beyond the
+#   max_categories most frequent of a feature, share one "infrequent" column
+SPARSE_PARAMS = {
+    "min_frequency": 5,
+    "max_categories": 20
+}
+
+def sparse_preprocess():
+    """True when the AMOS_SPARSE_PREPROCESS env variable turns sparse mode on"""
+    return os.environ.get("AMOS_SPARSE_PREPROCESS", "").lower() in ("1", "true", "yes")
+
+def preprocess_config(sparse=None):
+    """Settings of the column transformer, part of the model and artifact keys"""
+    sparse = sparse_preprocess() if sparse is None else sparse
+    return {"sparse": True, **SPARSE_PARAMS} if sparse else {"sparse": False}
+
+# tuned hyperparameters written by Tuning.py, they override the defaults above
+MODEL_PARAMS_FILE = Path(os.environ.get("AMOS_MODEL_PARAMS", Path.cwd() / "model_params.json"))
+
+def load_model_params(path=MODEL_PARAMS_FILE):
+    """Apply a tuned parameter config to MODEL_PARAMS/GRADIENT_PARAMS in place
+    Config layout:
+        {"version": 2, "params": {"tree": {...}, "forest": {...},
+                                  "gradient": {"exact": {...}, "hist": {...}}}}
+    Returns:
+        the config version, None when there is no config file
+    """
+    try:
+        config = json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return None
+    for model_type, params in config.get("params", {}).items():
+        if model_type == "gradient":
+            for backend, backend_params in params.items():
+                GRADIENT_PARAMS[backend].update(backend_params)
+        else:
+            MODEL_PARAMS[model_type].update(params)
+    logging.info(f"Loaded version {config.get('version')} of the model params from {path}")
+    return config.get("version")
+
+MODEL_PARAMS_VERSION = load_model_params()
+MODEL_PARAMS["gradient"] = GRADIENT_PARAMS[os.environ.get("AMOS_GRADIENT_BACKEND", "exact")]
+
+# content hashes of the data files, keyed by (path, mtime, size)
+_FINGERPRINTS = {}
+
+def frame_fingerprint(data):
+    """Content hash of a DataFrame or Series, index and column names included"""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    names = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+    digest.update(repr(list(names)).encode())
+    return digest.hexdigest()
+
+def file_fingerprint(filepath):
+    """Content hash of a data file
+    - The hash is only recomputed when the file mtime or size changes
+
+    Parameters:
+        filepath: str/Path object
+            -> path of the file to fingerprint
+    """
+    stat = Path(filepath).stat()
+    signature = (str(filepath), stat.st_mtime_ns, stat.st_size)
+    if signature not in _FINGERPRINTS:
+        digest = hashlib.sha1(Path(filepath).read_bytes()).hexdigest()
+        _FINGERPRINTS[signature] = digest
+    return _FINGERPRINTS[signature]
+
+# Column dtypes of the Kaggle house price files, pinned so that the csv
+# parser does not have to infer them
+CATEGORICAL_COLUMNS = [
+    "MSZoning", "Street", "Alley", "LotShape", "LandContour", "Utilities",
+    "LotConfig", "LandSlope", "Neighborhood", "Condition1", "Condition2",
+    "BldgType", "HouseStyle", "RoofStyle", "RoofMatl", "Exterior1st",
+    "Exterior2nd", "MasVnrType", "ExterQual", "ExterCond", "Foundation",
+    "BsmtQual", "BsmtCond", "BsmtExposure", "BsmtFinType1", "BsmtFinType2",
+    "Heating", "HeatingQC", "CentralAir", "Electrical", "KitchenQual",
+    "Functional", "FireplaceQu", "GarageType", "GarageFinish", "GarageQual",
+    "GarageCond", "PavedDrive", "PoolQC", "Fence", "MiscFeature", "SaleType",
+    "SaleCondition"
+]
+# never missing in train.csv nor test.csv
+INTEGER_COLUMNS = [
+    "Id", "MSSubClass", "LotArea", "OverallQual", "OverallCond", "YearBuilt",
+    "YearRemodAdd", "1stFlrSF", "2ndFlrSF", "LowQualFinSF", "GrLivArea",
+    "FullBath", "HalfBath", "BedroomAbvGr", "KitchenAbvGr", "TotRmsAbvGrd",
+    "Fireplaces", "WoodDeckSF", "OpenPorchSF", "EnclosedPorch", "3SsnPorch",
+    "ScreenPorch", "PoolArea", "MiscVal", "MoSold", "YrSold", "SalePrice"
+]
+# may be missing in at least one of the files
+FLOAT_COLUMNS = [
+    "LotFrontage", "MasVnrArea", "BsmtFinSF1", "BsmtFinSF2", "BsmtUnfSF",
+    "TotalBsmtSF", "BsmtFullBath", "BsmtHalfBath", "GarageYrBlt", "GarageCars",
+    "GarageArea"
+]
+DTYPES = {
+    **{col: "object" for col in CATEGORICAL_COLUMNS},
+    **{col: "int64" for col in INTEGER_COLUMNS},
+    **{col: "float64" for col in FLOAT_COLUMNS}
+}
+
+# raw frames parsed from the csv files, keyed by file content hash
+_RAW_FRAMES = {}
+_RAW_LOCK = threading.Lock()
+
+# dtypes that hold categorical features
+CATEGORICAL_DTYPES = ["object", "category"]
+
+def _csv_dtypes(categorical="object"):
+    """Pinned dtypes, columns missing from a file are ignored by the parser"""
+    return {**DTYPES, **{col: categorical for col in CATEGORICAL_COLUMNS}}
+
+def _stream_dtypes():
+    """Dtypes for files other than the Kaggle ones: numbers are read as
+    float64, so that a missing value in an integer column reaches the
+    imputers instead of failing the parse
+    """
+    return {
+        **{col: "float64" for col in (*INTEGER_COLUMNS, *FLOAT_COLUMNS) if col != "Id"},
+        **{col: "object" for col in CATEGORICAL_COLUMNS},
+        "Id": "int64"
+    }
+
+def _source_signature(filepath):
+    """What a columnar sidecar file records about its source csv"""
+    stat = Path(filepath).stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": file_fingerprint(filepath)}
+
+def _sidecar_is_fresh(meta_path, filepath):
+    """A sidecar is fresh when its source csv has the same mtime and hash"""
+    try:
+        source = json.loads(Path(meta_path).read_text())["source"]
+    except (FileNotFoundError, KeyError, json.JSONDecodeError):
+        return False
+    return source == _source_signature(filepath)
+
+def _write_atomic(path, write):
+    """Call write(file) on a temporary file and move it into place
+    - Workers rebuilding the same sidecar never leave half a file behind
+      for a reader, and the freshness metadata is written last
+    """
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+def _write_feather(df, filepath):
+    """Write the frame as a feather file next to the csv file"""
+    feather_path = Path(f"{filepath}.feather")
+    _write_atomic(feather_path, df.reset_index().to_feather)
+    meta = json.dumps({"source": _source_signature(filepath)})
+    _write_atomic(f"{feather_path}.json", lambda file: file.write(meta.encode()))
+
+def _read_feather(filepath):
+    """Load the feather sidecar, memory mapped"""
+    from pyarrow import feather
+    table = feather.read_table(f"{filepath}.feather", memory_map=True)
+    return table.to_pandas().set_index("Id")
+
+def _write_npy(df, filepath):
+    """Write one `.npy` file per column into a directory next to the csv file
+    - categorical columns are stored as integer codes plus their categories
+    """
+    npy_dir = Path(f"{filepath}.columns")
+    npy_dir.mkdir(exist_ok=True)
+    columns = []
+    for i, (name, col) in enumerate(df.reset_index().items()):
+        entry = {"name": name, "file": f"{i}.npy"}
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            entry["categories"] = col.cat.categories.to_list()
+            values = col.cat.codes.to_numpy()
+        else:
+            values = col.to_numpy()
+        _write_atomic(npy_dir / entry["file"], lambda file: np.save(file, values, allow_pickle=False))
+        columns.append(entry)
+    meta = json.dumps({"source": _source_signature(filepath), "columns": columns})
+    _write_atomic(npy_dir / "meta.json", lambda file: file.write(meta.encode()))
+
+def _read_npy(filepath):
+    """Load the `.npy` sidecar, numeric columns are memory mapped"""
+    npy_dir = Path(f"{filepath}.columns")
+    meta = json.loads((npy_dir / "meta.json").read_text())
+    data = {}
+    for entry in meta["columns"]:
+        values = np.load(npy_dir / entry["file"], mmap_mode="r")
+        if "categories" in entry:
+            values = pd.Categorical.from_codes(values, categories=entry["categories"])
+        data[entry["name"]] = values
+    index = pd.Index(data.pop("Id"), name="Id")
+    return pd.DataFrame(data, index=index, copy=False)
+
+# columnar sidecar formats: (reader, writer, freshness metadata file)
+COLUMNAR_FORMATS = {
+    "feather": (_read_feather, _write_feather, lambda filepath: f"{filepath}.feather.json"),
+    "npy": (_read_npy, _write_npy, lambda filepath: f"{filepath}.columns/meta.json")
+}
+
+def compact_frame(df):
+    """Same frame with smaller dtypes
+    - categorical columns become `category`
+    - integer columns are downcast to the smallest type holding their
+      values (eg. int16 for years, int8 for counts), float columns (areas,
+      columns with missing values) to float32
+    """
+    columns = {}
+    for name, col in df.items():
+        if col.dtype == object:
+            col = col.astype("category")
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            col = pd.to_numeric(col, downcast="integer")
+        elif pd.api.types.is_float_dtype(col.dtype):
+            col = col.astype(np.float32)
+        columns[name] = col
+    return pd.DataFrame(columns, index=df.index)
+
+def compact_memory():
+    """True when the AMOS_COMPACT_MEMORY env variable turns compact mode on"""
+    return os.environ.get("AMOS_COMPACT_MEMORY", "").lower() in ("1", "true", "yes")
+
+def frame_bytes(df):
+    """Bytes held by a frame, strings of object columns included"""
+    return int(df.memory_usage(deep=True).sum())
+
+def read_raw(filepath, columnar=None, compact=False):
+    """Parse a csv file once per process
+    - The returned frame is shared, treat it as read only
+    - Compact frames are not kept: compact mode drops the `wrangled` stage
+      to free it, a process wide copy would keep it alive
+    - With a columnar cache the first read writes a sidecar file with
+      categorical columns stored as `category`; later reads load the
+      sidecar instead of parsing the csv while it matches the csv
+
+    Parameters:
+        filepath: str/Path object
+            -> csv file to load
+        columnar: str/None
+            -> sidecar format, `feather` (needs pyarrow), `npy` or None
+        compact: bool
+            -> return the frame with the dtypes of `compact_frame`
+    """
+    key = (file_fingerprint(filepath), columnar, compact)
+    with _RAW_LOCK:
+        if key in _RAW_FRAMES:
+            count("amos_cache_requests_total", help="Cache lookups by result", cache="raw_frames", result="hit")
+            return _RAW_FRAMES[key]
+        count("amos_cache_requests_total", help="Cache lookups by result", cache="raw_frames", result="miss")
+
+        if columnar is None:
+            logging.info(f"Parsing {filepath}")
+            # strings are parsed straight into categories in compact mode
+            dtypes = _csv_dtypes(categorical="category" if compact else "object")
+            with timed("amos_data_read_seconds", "Seconds spent loading data files", format="csv"):
+                df = pd.read_csv(filepath, dtype=dtypes).set_index("Id")
+            count("amos_data_reads_total", help="Data files parsed or loaded", format="csv")
+        else:
+            reader, writer, meta_path = COLUMNAR_FORMATS[columnar]
+            if _sidecar_is_fresh(meta_path(filepath), filepath):
+                logging.info(f"Loading the {columnar} cache of {filepath}")
+                with timed("amos_data_read_seconds", "Seconds spent loading data files", format=columnar):
+                    df = reader(filepath)
+                count("amos_data_reads_total", help="Data files parsed or loaded", format=columnar)
+            else:
+                logging.info(f"Parsing {filepath} into a {columnar} cache")
+                dtypes = _csv_dtypes(categorical="category")
+                with timed("amos_data_read_seconds", "Seconds spent loading data files", format="csv"):
+                    df = pd.read_csv(filepath, dtype=dtypes).set_index("Id")
+                count("amos_data_reads_total", help="Data files parsed or loaded", format="csv")
+                writer(df, filepath)
+
+        if compact:
+            return compact_frame(df)
+        _RAW_FRAMES[key] = df
+        return df
+
+def engineer_features(df, sub_class=None, engineer=True):
+    """Engineered features of a frame, see `WrangleRepository.feature_engineering`
+    - Works on a copy, the given frame is not modified
+    - Also accepts a dict of numpy columns, the fast path for a few records
+    """
+    if isinstance(df, pd.DataFrame) and pd.get_option("mode.copy_on_write") is True:
+        # columns are copied only when written to, unchanged ones stay shared
+        df = df.copy(deep=False)
+    else:
+        df = df.copy()
+    # subclass modification
+    if isinstance(df, dict):
+        mapping = sub_class or {}
+        df["MSSubClass"] = np.array([mapping.get(v, v) for v in df["MSSubClass"]], dtype=object)
+    else:
+        df["MSSubClass"] = df["MSSubClass"].replace(sub_class)
+    if engineer:
+        # Remodified date 
+        df["RemodAfter"] = df["YearRemodAdd"] - df["YearBuilt"]
+        # Remodified buildings 
+        df["Remod"] = df["RemodAfter"] > 0
+        # Total sq feets 
+        df["BsmtFinished"] = df["TotalBsmtSF"] - df["BsmtUnfSF"]
+        # full bathrooms 
+        df["FullBathrooms"] = df["BsmtFullBath"] + df["FullBath"]
+        # half bathrooms 
+        df["HalfBathrooms"] = df["BsmtHalfBath"] + df["HalfBath"]
+        # getting the age of the building
+        df["HouseAge"] = (df["YrSold"] - df["YearBuilt"]) + (df["MoSold"]/12)
+    return df
 
 # Wrangle class object
 class WrangleRepository:
     """Control our loading and data cleaning
     - Load the csvfile into a dataframe
+    - Each stage is computed from its parent stage and kept, it is only
+      recomputed when its parameters or its parent change
+    - `timings` holds the seconds each stage took on its last run
+    - Compact mode loads the data with `compact_frame` dtypes, builds the
+      stages with pandas copy-on-write so that they share the columns
+      they do not change, and drops every stage not in keep_stages once
+      its child stage is built; a dropped stage is rebuilt from its
+      parents (same params) if it is asked for again. See `memory_report`
 
     Parameters:
         root_path: str/path object
             -> path where you are currently on
         file_name: str 
             -> Name of the csv file, remember to include `.csv` extension
+        columnar_cache: str/None
+            -> columnar sidecar format used by `read_raw` (`feather` or
+               `npy`), by default the AMOS_COLUMNAR_CACHE env variable
+        compact: bool/None
+            -> compact memory mode, by default the AMOS_COMPACT_MEMORY
+               env variable
+        keep_stages: iterable/None
+            -> stages kept in memory in compact mode, the final `outlier`
+               stage by default
     """
+    # stage -> parent stage
+    stages = {
+        "wrangled": None,
+        "basic": "wrangled",
+        "selected": "basic",
+        "engineered": "selected",
+        "outlier": "engineered"
+    }
+
     # instance of our class 
     def __init__(
         self,
         sub_class = None,
         root_path = Path.cwd(),
-        file_name = "train.csv"
+        file_name = "train.csv",
+        columnar_cache = None,
+        compact = None,
+        keep_stages = None
     ):
         logging.info("Inintialized our class instances!")
         self.sub_class = sub_class
         self.filepath = root_path / file_name
+        if columnar_cache is None:
+            columnar_cache = os.environ.get("AMOS_COLUMNAR_CACHE") or None
+        self.columnar_cache = columnar_cache
+        if compact is None:
+            compact = compact_memory()
+        self.compact = compact
+        self.keep_stages = set(keep_stages) if keep_stages is not None else {"outlier"}
+        self.timings = {}
+        # stage -> rows, columns and (for dropped stages) bytes
+        self.stage_info = {}
+        self._stage_keys = {}
+        self._versions = {}
+        self._computes = {}
+
+    def _compute(self, stage, compute):
+        """Run a stage computation, sharing unchanged columns in compact mode"""
+        with timed("amos_wrangle_stage_seconds", "Seconds per WrangleRepository stage", stage=stage) as timer:
+            if self.compact:
+                with pd.option_context("mode.copy_on_write", True):
+                    df = compute()
+            else:
+                df = compute()
+        self.timings[stage] = timer.seconds
+        count("amos_rows_processed_total", len(df), "Rows coming out of each stage", stage=stage)
+        self.stage_info[stage] = {"rows": df.shape[0], "columns": df.columns.to_list()}
+        setattr(self, f"df_{stage}", df)
+
+        # the parent is not needed anymore once its child is built
+        parent = self.stages[stage]
+        if self.compact and parent is not None and parent not in self.keep_stages:
+            self._release(parent)
+        return df
+
+    def _release(self, stage):
+        """Drop the frame of a stage, keeping what is needed to rebuild it"""
+        df = self.__dict__.pop(f"df_{stage}", None)
+        if df is not None:
+            self.stage_info[stage]["bytes"] = frame_bytes(df)
+
+    def _run_stage(self, stage, params, compute):
+        """Compute a stage unless it is cached for the same params and parent"""
+        parent = self.stages[stage]
+        key = (params, self._versions.get(parent))
+        if self._stage_keys.get(stage) != key:
+            self._compute(stage, compute)
+            self._computes[stage] = compute
+            self._stage_keys[stage] = key
+            self._versions[stage] = self._versions.get(stage, 0) + 1
+        return self._stage_data(stage)
+
+    def _stage_data(self, stage):
+        """Frame of a computed stage, rebuilt if compact mode dropped it
+        - The rebuilt frame equals the dropped one, so the version of the
+          stage (and the cache of its child stages) is kept
+        """
+        df = getattr(self, f"df_{stage}", None)
+        if df is None and stage in self._computes:
+            logging.info(f"Rebuilding the released {stage} stage")
+            df = self._compute(stage, self._computes[stage])
+        return df
+
+    def _parent_data(self, stage):
+        """Get the parent stage data, computing it with defaults if missing"""
+        parent = self.stages[stage]
+        if parent not in self._stage_keys:
+            {
+                "wrangled": self.wrangle,
+                "basic": self.basic_cleaning,
+                "selected": self.feature_selection,
+                "engineered": self.feature_engineering
+            }[parent]()
+        return self._stage_data(parent)
 
     # Get the DataFrame 
     def wrangle(self):
         """Load the csv file into a DataFrame
         """
         logging.info("Loading the csv file into a dataframe")
-        # loading the csv file 
-        df = pd.read_csv(self.filepath).set_index("Id")
-        
-        self.df_wrangled = df
-    
-        return df
+        return self._run_stage(
+            "wrangled",
+            (file_fingerprint(self.filepath), self.columnar_cache, self.compact),
+            lambda: read_raw(self.filepath, columnar=self.columnar_cache, compact=self.compact)
+        )
 
     # Basic cleaning - function
     def basic_cleaning(self, missing_values_pct=None, clean=True):
@@ -62,28 +529,29 @@ class WrangleRepository:
             clean: bool (True/False)
                 
         """
-        # getting the DataFrame(df)
-        df = self.wrangle()
-        
-        if clean:
+        def compute():
+            # getting the DataFrame(df)
+            df = self._parent_data("basic")
+            if not clean:
+                return df
+
+            pct = missing_values_pct
             # compute missing numerical values 
-            if missing_values_pct is None:
-                missing_values = (df.isnull().sum()[df.isnull().sum() > 1]).sort_values()
+            if pct is None:
+                missing_counts = df.isnull().sum()
+                missing_values = missing_counts[missing_counts > 1].sort_values()
                 # percentage counts 
-                missing_values_pct = pd.Series(((100 * missing_values.values / len(df))),
-                                               index=missing_values.index, name="missing_pct")
+                pct = pd.Series(((100 * missing_values.values / len(df))),
+                                index=missing_values.index, name="missing_pct")
             # drop high missing values features 
-            mask = missing_values_pct > 50
-            missing_cols = missing_values_pct[mask].index.to_list()
+            missing_cols = pct[pct > 50].index.to_list()
             logging.info(f"Dropped  high missing values features: \n {missing_cols}")
-            
+
             # drop columns 
-            df.drop(columns=missing_cols, inplace=True)
+            return df.drop(columns=missing_cols)
 
-        self.df_basic = df
-    
-        # return 
-        return df
+        pct_key = None if missing_values_pct is None else tuple(missing_values_pct.items())
+        return self._run_stage("basic", (pct_key, clean), compute)
 
     # Feature selection 
     def feature_selection(self, variance_selector=True, threshold_num=0.05, threshold_cat=0.95):
@@ -98,32 +566,34 @@ class WrangleRepository:
             threshold_cat: float
                 -> Decimal threshold for categorical variables, by default is 95%
         """
-        # Getting the df, basic cleaning 
-        df = self.df_basic
-        
-        if variance_selector:
+        def compute():
+            # Getting the df, basic cleaning 
+            df = self._parent_data("selected")
+            if not variance_selector:
+                return df
+
             logging.info("Computing low variance feature selection")
             # get numerical features 
             num_feat = df.select_dtypes(include="number")
-            
+
             # instantiating
             val_selector = VarianceThreshold(threshold=threshold_num)
-            # fitting and transforming
-            val_selector.fit_transform(num_feat)
+            # fitting
+            val_selector.fit(num_feat)
             high_val_feat = num_feat.columns[val_selector.get_support()]
-            
-            # making the dataframe 
-            df = pd.concat([df[high_val_feat], df.select_dtypes(include="object")], axis=1)
-    
+
             # high variance for categorical variables 
-            high_val_cat = [col for col in df.select_dtypes(include="object")
-                            if df[col].value_counts(normalize=True).iloc[0] > threshold_cat
+            cat_feat = df.select_dtypes(include=CATEGORICAL_DTYPES)
+            high_val_cat = [col for col in cat_feat
+                            if cat_feat[col].value_counts(normalize=True).iloc[0] <= threshold_cat
             ]
-            df.drop(columns=high_val_cat, inplace=True)
 
-        self.df_selected = df
-        # return 
-        return df
+            # making the dataframe 
+            return pd.concat([df[high_val_feat], cat_feat[high_val_cat]], axis=1)
+
+        return self._run_stage(
+            "selected", (variance_selector, threshold_num, threshold_cat), compute
+        )
 
     # Feature Engineering - function
     def feature_engineering(self, engineer=True):
@@ -135,44 +605,93 @@ class WrangleRepository:
             enginering: bool
                 -> to do feature enginerring or not, either True/False
         """
-        # Getting the df from selected features
-        df = self.df_selected
-        # subclass modification
-        df["MSSubClass"] = df["MSSubClass"].replace(self.sub_class)
-        if engineer:
-            # Remodified date 
-            df["RemodAfter"] = df["YearRemodAdd"] - df["YearBuilt"]
-            # Remodified buildings 
-            df["Remod"] = df["RemodAfter"] > 0
-            # Total sq feets 
-            df["BsmtFinished"] = df["TotalBsmtSF"] - df["BsmtUnfSF"]
-            # full bathrooms 
-            df["FullBathrooms"] = df["BsmtFullBath"] + df["FullBath"]
-            # half bathrooms 
-            df["HalfBathrooms"] = df["BsmtHalfBath"] + df["HalfBath"]
-            # getting the age of the building
-            df["HouseAge"] = (df["YrSold"] - df["YearBuilt"]) + (df["MoSold"]/12)
-
-        self.df_engineered = df
-        # return 
-        return df
-    def remove_outliers(self, upper_quantile=0.9, lower_quantile=0.1):
+        def compute():
+            # Getting the df from selected features
+            return engineer_features(self._parent_data("engineered"), self.sub_class, engineer)
+
+        sub_class_key = None if self.sub_class is None else tuple(self.sub_class.items())
+        return self._run_stage("engineered", (engineer, sub_class_key), compute)
+
+    def remove_outliers(
+        self,
+        upper_quantile=0.9,
+        lower_quantile=0.1,
+        columns=None,
+        quantiles=None,
+        method="quantile",
+        iqr_factor=1.5,
+        z_threshold=3.5
+    ):
         """Remove outliers from out numerical columns
+        - All bounds are computed at once and combined into a single row
+          mask, a row is dropped if any of the columns flags it
+        - Missing values are never flagged, columns without spread (eg.
+          mostly zero columns) are skipped
+        - `outlier_report` holds how many rows each column flagged
+
         Parameters:
             upper_quantile: int
                 -> upper quantile to check
             lower_quantile: int
                 -> lower floor to get our data
+            columns: list/None
+                -> columns to check, all numerical columns by default
+            quantiles: dict/None
+                -> per column (lower, upper) quantile overrides
+            method: str
+                -> `quantile`, `iqr` (Tukey fences) or `zscore` (robust
+                   z-score from the median and MAD)
+            iqr_factor: float
+                -> fence width for the `iqr` method
+            z_threshold: float
+                -> cut off for the `zscore` method
         """
-        # Get the df 
-        df = self.df_engineered
-        # Remove outliers
-        for col in df.select_dtypes(include="number").columns:
-            q_l, q_u = df[col].quantile([lower_quantile, upper_quantile])
-            mask = df[df[col].between(q_l, q_u)]
+        def compute():
+            # Get the df 
+            df = self._parent_data("outlier")
+            num = df[columns] if columns is not None else df.select_dtypes(include="number")
+            values = num.to_numpy(dtype=float)
+
+            if method == "quantile":
+                # every quantile we need, in one call
+                bounds = {col: (lower_quantile, upper_quantile) for col in num.columns}
+                bounds.update(quantiles or {})
+                levels = sorted({q for pair in bounds.values() for q in pair})
+                table = num.quantile(levels).to_numpy()
+                positions = {q: i for i, q in enumerate(levels)}
+                cols = np.arange(num.shape[1])
+                lower = table[[positions[bounds[col][0]] for col in num.columns], cols]
+                upper = table[[positions[bounds[col][1]] for col in num.columns], cols]
+            elif method == "iqr":
+                q1, q3 = num.quantile([0.25, 0.75]).to_numpy()
+                lower = q1 - iqr_factor * (q3 - q1)
+                upper = q3 + iqr_factor * (q3 - q1)
+            elif method == "zscore":
+                median = np.nanmedian(values, axis=0)
+                mad = 1.4826 * np.nanmedian(np.abs(values - median), axis=0)
+                lower = median - z_threshold * mad
+                upper = median + z_threshold * mad
+            else:
+                raise ValueError(f"Unknown outlier method: {method}")
+
+            # (rows, columns) flags, broadcasting the bounds over the rows
+            with np.errstate(invalid="ignore"):
+                flagged = (values < lower) | (values > upper)
+            flagged[:, upper <= lower] = False
+
+            self.outlier_report = pd.Series(
+                flagged.sum(axis=0), index=num.columns, name="rows_removed"
+            )
+            logging.info(f"Outlier rows removed per column: \n {self.outlier_report[self.outlier_report > 0]}")
+            return df[~flagged.any(axis=1)]
 
-        self.df_outlier = mask
-        return mask
+        params = (
+            upper_quantile, lower_quantile,
+            None if columns is None else tuple(columns),
+            None if quantiles is None else tuple(sorted(quantiles.items())),
+            method, iqr_factor, z_threshold
+        )
+        return self._run_stage("outlier", params, compute)
 
     # finally getting the data 
     def get_data(self, stage="outlier"):
@@ -182,19 +701,163 @@ class WrangleRepository:
         - selected: feature selected data
         - engineered: feature engineered data
         - outlier removed features
+        - None for a stage that was never computed
+        """
+        return self._stage_data(stage)
+
+    def stage_columns(self, stage):
+        """Columns of a computed stage without rebuilding it, None if it was never computed"""
+        info = self.stage_info.get(stage)
+        return None if info is None else info["columns"]
+
+    def memory_report(self):
+        """Rows, columns and bytes of every computed stage
+        - held: whether the stage frame is still in memory, the bytes of
+          dropped stages were measured when they were dropped
+        - Stages built with copy-on-write share columns, so the total held
+          by the repository may be lower than the sum of the held bytes
         """
-        return getattr(self, f"df_{stage}", None)
+        rows = {}
+        for stage, info in self.stage_info.items():
+            df = getattr(self, f"df_{stage}", None)
+            rows[stage] = {
+                "rows": info["rows"],
+                "columns": len(info["columns"]),
+                "bytes": frame_bytes(df) if df is not None else info.get("bytes"),
+                "held": df is not None
+            }
+        return pd.DataFrame.from_dict(rows, orient="index")
+
     def __repr__(self):
         return f"WrangleRepository filepath={self.filepath}"
 
 
+# fitted column transformers and their output matrix, keyed by the
+# fingerprint of the frame they were fitted on
+_PREPROCESSED = OrderedDict()
+_PREPROCESSED_LOCK = threading.Lock()
+_PREPROCESSED_SIZE = 4
+
+# Replaying the wrangling on new data
+class FeatureTransformer:
+    """Apply the wrangling learned on train.csv to any new frame
+    - `fit` reads the stages of a WrangleRepository: the columns dropped by
+      basic cleaning, the columns kept by feature selection and the
+      engineered features
+    - `transform` applies them to raw rows (test.csv layout) in one pass
+    """
+    def __init__(self, target="SalePrice"):
+        self.target = target
+
+    def fit(self, repo):
+        """Learn the columns from the stages of a wrangled repository
+        Parameters:
+            repo: WrangleRepository
+                -> repository whose stages up to `engineered` were computed
+        """
+        # only the columns are needed, stages dropped in compact mode are not rebuilt
+        raw = repo.stage_columns("wrangled")
+        basic = repo.stage_columns("basic")
+        selected = repo.stage_columns("selected")
+        engineered = repo.stage_columns("engineered")
+
+        self.dropped_columns_ = [col for col in raw if col not in basic]
+        self.selected_columns_ = [col for col in selected if col != self.target]
+        self.engineered_columns_ = [col for col in engineered if col not in selected]
+        self.columns_ = [col for col in engineered if col != self.target]
+        self.sub_class = repo.sub_class
+        return self
+
+    def transform(self, df):
+        """Feature matrix of raw rows, columns in training order"""
+        if not hasattr(self, "columns_"):
+            raise RuntimeError("FeatureTransformer is not fitted yet, call fit first")
+        missing = [col for col in self.selected_columns_ if col not in df.columns]
+        if missing:
+            raise ValueError(f"Input is missing the columns: {missing}")
+        return engineer_features(df[self.selected_columns_], self.sub_class)[self.columns_]
+
+    def transform_columns(self, data):
+        """`transform` for a dict of numpy columns, see Inference.record_columns"""
+        engineered = engineer_features({col: data[col] for col in self.selected_columns_}, self.sub_class)
+        return {col: engineered[col] for col in self.columns_}
+
+    # so that it can be passed wherever a transform function is expected
+    __call__ = transform
+
+    def __repr__(self):
+        return f"FeatureTransformer columns={len(getattr(self, 'columns_', []))}"
+
+
 class MakePipeline:
     """This class will make all the necessary pipelines 
     - column transformer
+    - shared preprocessing: the column transformer is fitted once per
+      training frame and every model head (and PCA) trains on its cached
+      output, see `fit_shared`
+    - sparse mode keeps the one-hot matrix in CSR from the encoder to the
+      model heads (see SPARSE_PARAMS); the linear model (lsqr), the trees
+      and PCA (arpack, or TruncatedSVD) all fit it without densifying
+
+    Parameters:
+        X_train: pd.DataFrame
+            -> training features
+        sparse: bool/None
+            -> sparse mode, by default the AMOS_SPARSE_PREPROCESS env variable
     """
 
-    def __init__(self, X_train):
+    def __init__(self, X_train, sparse=None):
         self.X_train = X_train
+        self.sparse = sparse_preprocess() if sparse is None else sparse
+
+    def preprocess(self):
+        """Fit the column transformer on X_train once and cache its output
+        - Returns (fitted column transformer, transformed matrix), shared
+          by every MakePipeline on the same data; treat both as read only
+        """
+        key = (frame_fingerprint(self.X_train), json.dumps(preprocess_config(self.sparse), sort_keys=True))
+        with _PREPROCESSED_LOCK:
+            if key in _PREPROCESSED:
+                _PREPROCESSED.move_to_end(key)
+                return _PREPROCESSED[key]
+
+            logging.info("Fitting the shared column transformer")
+            col_pipeline = self.make_column_pipeline()
+            with timed("amos_fit_seconds", "Seconds per pipeline fit", model="preprocess"):
+                Xt = col_pipeline.fit_transform(self.X_train)
+            count("amos_model_fits_total", help="Pipeline fits", model="preprocess")
+            _PREPROCESSED[key] = (col_pipeline, Xt)
+            if len(_PREPROCESSED) > _PREPROCESSED_SIZE:
+                _PREPROCESSED.popitem(last=False)
+            return col_pipeline, Xt
+
+    @staticmethod
+    def shares_preprocess(pipeline):
+        """True when the pipeline starts with the shared one-hot column transformer"""
+        return not isinstance(pipeline.steps[-1][1], HistGradientBoostingRegressor)
+
+    def fit_shared(self, pipeline, y_train=None):
+        """Fit a `make_*_pipeline` pipeline on the shared preprocessed matrix
+        - Only the last step is fitted, the returned pipeline predicts the
+          same as `pipeline.fit(X_train, y_train)`
+        - Pipelines with their own preprocessing (native categoricals) are
+          fitted as a whole
+
+        Parameters:
+            pipeline: Pipeline
+                -> unfitted pipeline from one of the make methods
+            y_train: pd.Series/None
+                -> target, None for PCA
+        """
+        head_name, head = pipeline.steps[-1]
+        count("amos_model_fits_total", help="Pipeline fits", model=head_name)
+        if not self.shares_preprocess(pipeline):
+            with timed("amos_fit_seconds", "Seconds per pipeline fit", model=head_name):
+                return pipeline.fit(self.X_train, y_train)
+        col_pipeline, Xt = self.preprocess()
+        with timed("amos_fit_seconds", "Seconds per pipeline fit", model=head_name):
+            head.fit(Xt, y_train)
+        return Pipeline([("preprocess", col_pipeline), (head_name, head)])
 
     def make_column_pipeline(self):
         """Make the column transformer pipeline"""
@@ -204,27 +867,72 @@ class MakePipeline:
             ("scaler", StandardScaler())
         ])
 
-        # Categorical pipeline
+        # Categorical pipeline, rare categories are collapsed in sparse mode
+        if self.sparse:
+            encoder = OneHotEncoder(handle_unknown="infrequent_if_exist", **SPARSE_PARAMS)
+        else:
+            encoder = OneHotEncoder(handle_unknown="ignore")
         cat_pipeline = Pipeline([
             ("imputer", SimpleImputer(strategy="most_frequent")),
-            ("encoder", OneHotEncoder(handle_unknown="ignore"))
+            ("encoder", encoder)
         ])
 
-        # Column transformer
+        # Column transformer, the default threshold picks the output format
+        # from the density, sparse mode always returns CSR
         col_pipeline = ColumnTransformer([
             ("NumericalFeatures", num_pipeline, self.X_train.select_dtypes(include="number").columns),
-            ("CategoricalFeatures", cat_pipeline, self.X_train.select_dtypes(include="object").columns)
-        ])
+            ("CategoricalFeatures", cat_pipeline, self.X_train.select_dtypes(include=CATEGORICAL_DTYPES).columns)
+        ], sparse_threshold=1.0 if self.sparse else 0.3)
 
         self._columns_pipeline = col_pipeline
         return col_pipeline
-    def make_pca_pipeline(self):
-        """Pca pipeline"""
+
+    def make_native_column_pipeline(self):
+        """Column transformer for models with native missing value and
+        categorical support: numbers pass through, categories become
+        ordinal codes (unknown and missing values -> NaN)
+        Returns:
+            (column transformer, boolean mask of the categorical outputs)
+        """
+        numerical = self.X_train.select_dtypes(include="number").columns
+        categorical = self.X_train.select_dtypes(include=CATEGORICAL_DTYPES).columns
+        encoder = OrdinalEncoder(
+            handle_unknown="use_encoded_value",
+            unknown_value=np.nan,
+            encoded_missing_value=np.nan
+        )
+        col_pipeline = ColumnTransformer([
+            ("NumericalFeatures", "passthrough", numerical),
+            ("CategoricalFeatures", encoder, categorical)
+        ])
+        categorical_mask = [False] * len(numerical) + [True] * len(categorical)
+        return col_pipeline, categorical_mask
+    def make_pca_pipeline(self, method="full"):
+        """Pca pipeline
+        Parameters:
+            method: str
+                -> full: exact SVD
+                   randomized: randomized SVD, faster on large dense matrices
+                   incremental: IncrementalPCA, fitted in row batches so
+                   the matrix is never densified at once
+                   truncated: TruncatedSVD, randomized and sparse friendly
+                   but without centering, so the component differs from PCA
+        """
         col_pipeline = self.make_column_pipeline()
+        if method == "incremental":
+            pca = IncrementalPCA(n_components=1, batch_size=10_000)
+        elif method == "truncated":
+            pca = TruncatedSVD(n_components=1, algorithm="randomized", random_state=42)
+        elif method == "randomized":
+            pca = PCA(n_components=1, svd_solver="randomized", random_state=42)
+        elif method == "full":
+            pca = PCA(n_components=1, random_state=42)
+        else:
+            raise ValueError(f"Unknown PCA method: {method}")
         pca_pipeline = Pipeline(
             [
                 ("preprocess", col_pipeline),
-                ("PCA Algorithm", PCA(n_components=1, random_state=42))
+                ("PCA Algorithm", pca)
             ]
         )
 
@@ -239,7 +947,7 @@ class MakePipeline:
         linear_pipeline = Pipeline(
             [
                 ("preprocess", col_pipeline),
-                ("linear_model", LinearRegression())
+                ("linear_model", LinearRegression(**MODEL_PARAMS["linear"]))
             ]
         ) 
 
@@ -256,12 +964,7 @@ class MakePipeline:
         tree_pipeline = Pipeline(
                     [
                         ("preprocess", col_pipeline),
-                        ("tree_model", DecisionTreeRegressor(
-                            random_state=42,
-                            min_samples_leaf=1,
-                            min_samples_split=6,
-                            max_depth=7
-                        ))
+                        ("tree_model", DecisionTreeRegressor(**MODEL_PARAMS["tree"]))
                     ]
                 )
         # return the model pipeline 
@@ -276,34 +979,36 @@ class MakePipeline:
         forest_pipeline = Pipeline(
                     [
                         ("preprocess", col_pipeline),
-                        ("forest_model", RandomForestRegressor(
-                            random_state=42,
-                            n_estimators = 60,
-                            min_samples_leaf=1,
-                            min_samples_split=4,
-                            max_depth= 10
-                        ))
+                        ("forest_model", RandomForestRegressor(**MODEL_PARAMS["forest"]))
                     ]
                 )
         # return the model pipeline 
         self._forest_pipeline = forest_pipeline
 
         return forest_pipeline
-    def make_gradient_boosting_pipeline(self):
-        """Make the random forest pipeline"""
-        col_pipeline = self.make_column_pipeline()
+    def make_gradient_boosting_pipeline(self, backend=None):
+        """Make the gradient boosting pipeline
+        Parameters:
+            backend: str
+                -> exact or hist, by default the one of MODEL_PARAMS
+                   (see GRADIENT_PARAMS)
+        """
+        params = dict(MODEL_PARAMS["gradient"] if backend is None else GRADIENT_PARAMS[backend])
+        backend = params.pop("backend")
 
-        # decision tree pipeline 
+        if backend == "hist":
+            # categorical columns are split natively, no one-hot encoding
+            col_pipeline, categorical_mask = self.make_native_column_pipeline()
+            model = HistGradientBoostingRegressor(categorical_features=categorical_mask, **params)
+        else:
+            col_pipeline = self.make_column_pipeline()
+            model = GradientBoostingRegressor(**params)
+
+        # gradient boosting pipeline 
         gradient_pipeline = Pipeline(
                     [
                         ("preprocess", col_pipeline),
-                        ("forest_model", GradientBoostingRegressor(
-                            random_state=42,
-                            n_estimators = 100,
-                            min_samples_leaf=1,
-                            min_samples_split=3,
-                            max_depth= 2
-                        ))
+                        ("gradient_model", model)
                     ]
                 )
         # return the model pipeline 
@@ -325,12 +1030,73 @@ class MakePipeline:
         return f"Pipeline Stage presenter:"
 
 
+# Parallel training of the model heads
+def fit_head(head, data_path, n_jobs=1):
+    """Fit a model head on the shared preprocessed matrix in a worker process
+    - (Xt, y) are memory mapped from data_path, so the pool shares one copy
+      of the matrix instead of pickling it to every worker
+    - Native (BLAS/OpenMP) threads and the estimator `n_jobs` are capped
+      at the CPU share given to this head during the fit, the returned
+      head keeps its own `n_jobs`
+
+    Parameters:
+        head: estimator
+            -> unfitted last step of a `make_*_pipeline` pipeline, or a
+               whole pipeline that does its own preprocessing
+        data_path: str/Path object
+            -> joblib file holding (Xt, y), or (X_train, y) for a pipeline
+        n_jobs: int
+            -> CPUs this head may use
+    Returns:
+        (fitted head, fit seconds)
+    """
+    from threadpoolctl import threadpool_limits
+
+    Xt, y = joblib.load(data_path, mmap_mode="r")
+    params = head.get_params()
+    if "n_jobs" in params:
+        head.set_params(n_jobs=n_jobs)
+    # in a pool process these metrics stay in that process
+    name = head.steps[-1][0] if isinstance(head, Pipeline) else type(head).__name__
+    count("amos_model_fits_total", help="Pipeline fits", model=name)
+    with threadpool_limits(limits=n_jobs), timed("amos_fit_seconds", "Seconds per pipeline fit", model=name) as timer:
+        head.fit(Xt, y)
+    if "n_jobs" in params:
+        # the stored head predicts in the web worker, not with the training CPU share
+        head.set_params(n_jobs=params["n_jobs"])
+    return head, timer.seconds
+
+
 # Learning curve plotting
+def _learning_curve_point(head, Xt_train, y_train, Xt_val, y_val, n):
+    """Fit a copy of the model head on the first n training rows of a fold and score it"""
+    model = clone(head).fit(Xt_train[:n], y_train[:n])
+    return (
+        r2_score(y_train[:n], model.predict(Xt_train[:n])),
+        r2_score(y_val, model.predict(Xt_val))
+    )
+
 class LearningCurve:
     """Train and build learning curve plot
+    - Every (fold, train size) score is cached on disk, keyed by the model
+      params and the data fingerprint, so only missing points are fitted
+      (eg. after adding train sizes or fold repeats)
+    - For a pipeline the `preprocess` step is fitted once per fold, on
+      the training rows of that fold only, and its output is reused by
+      every train size of the fold; only the model head is refitted
     """
     # class instantiation 
-    def __init__(self,estimator, X, y):
+    def __init__(
+        self,
+        estimator,
+        X,
+        y,
+        train_sizes=np.linspace(0.1, 1.0, 5),
+        cv=5,
+        n_repeats=1,
+        n_jobs=None,
+        cache_dir=Path.cwd() / ".cache" / "learning_curves"
+    ):
         """
         Parameters:
             estimator:
@@ -339,27 +1105,104 @@ class LearningCurve:
                 -> A training feature matrix(x,y)
             val: pd.DataFrame
                 -> A validation feature matrix
+            train_sizes: array
+                -> fractions of the training fold to fit on
+            cv: int
+                -> number of folds
+            n_repeats: int
+                -> repeats of the k folds, raising it only adds folds
+            n_jobs: int
+                -> parallel fits, by default at most 4 so that gunicorn
+                   hosts are not oversubscribed
+            cache_dir: str/Path object/None
+                -> where fold scores are kept, None disables the cache
         """
         self.estimator = estimator 
         self.X = X 
         self.y = y
+        self.train_sizes = train_sizes
+        self.cv = cv
+        self.n_repeats = n_repeats
+        self.n_jobs = n_jobs if n_jobs is not None else min(4, os.cpu_count() or 1)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+
+    def cache_key(self):
+        """Fingerprint of the model params, the data and the fold setup"""
+        params = joblib.hash(clone(self.estimator))
+        # "fold-preprocess": points scored with a preprocess step fitted per fold
+        return hashlib.sha1(
+            f"{params}:{frame_fingerprint(self.X)}:{frame_fingerprint(self.y)}:{self.cv}:fold-preprocess".encode()
+        ).hexdigest()
+
+    def _read_cache(self, path):
+        try:
+            return json.loads(path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_cache(self, path, points):
+        # merge with points other processes may have stored meanwhile
+        points = {**self._read_cache(path), **points}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(points))
+        os.replace(tmp_path, path)
+
     # learning curve building
+    @timed("amos_learning_curve_seconds", "Seconds per learning curve, cached points included")
     def learning_curve(self):
         """Building the learning curve and returning results"""
-        train_size, train_score, val_score = learning_curve(
-            estimator=self.estimator,
-            X = self.X,
-            y = self.y,
-            random_state=42,
-            verbose=1,
-            n_jobs=-1,
-            scoring='r2',
-            shuffle=True
-        )
-        
-        # converting negatibe maes 
-        train_score = np.mean(train_score, axis=1)
-        val_score = np.mean(val_score, axis=1)
+        y = np.asarray(self.y)
+        folds = list(RepeatedKFold(n_splits=self.cv, n_repeats=self.n_repeats, random_state=42).split(self.X))
+
+        # absolute train sizes, as sklearn learning_curve computes them
+        n_max = min(len(train) for train, val in folds)
+        train_size = np.unique(np.clip((np.asarray(self.train_sizes) * n_max).astype(int), 1, n_max))
+
+        cache_path = None if self.cache_dir is None else self.cache_dir / f"{self.cache_key()}.json"
+        points = {} if cache_path is None else self._read_cache(cache_path)
+        missing = [(f, n) for f in range(len(folds)) for n in train_size if f"{f}:{n}" not in points]
+        logging.info(f"Learning curve: {len(missing)} points to fit, {len(folds) * len(train_size) - len(missing)} cached")
+
+        if missing:
+            if isinstance(self.estimator, Pipeline) and "preprocess" in self.estimator.named_steps:
+                preprocess = self.estimator.named_steps["preprocess"]
+                head = self.estimator.steps[-1][1]
+            else:
+                preprocess, head = None, self.estimator
+
+            def encode(fold):
+                # the training fold is shuffled once per fold, every size
+                # is a prefix of it so that sizes can be added later
+                train, val = folds[fold]
+                train = np.random.RandomState(42 + fold).permutation(train)
+                if isinstance(self.X, pd.DataFrame):
+                    X_train, X_val = self.X.iloc[train], self.X.iloc[val]
+                else:
+                    X_train, X_val = self.X[train], self.X[val]
+                if preprocess is not None:
+                    # fitted on the training rows of the fold only
+                    fitted = clone(preprocess).fit(X_train, y[train])
+                    X_train, X_val = fitted.transform(X_train), fitted.transform(X_val)
+                if isinstance(X_train, pd.DataFrame):
+                    X_train, X_val = X_train.to_numpy(), X_val.to_numpy()
+                return X_train, y[train], X_val, y[val]
+
+            # encode once per fold, only the model head is refitted per point
+            encoded = {f: encode(f) for f in sorted({f for f, n in missing})}
+
+            count("amos_learning_curve_points_total", len(missing), "Learning curve points fitted")
+            scores = Parallel(n_jobs=self.n_jobs)(
+                delayed(_learning_curve_point)(head, *encoded[f], n) for f, n in missing
+            )
+            new_points = {f"{f}:{n}": list(score) for (f, n), score in zip(missing, scores)}
+            points.update(new_points)
+            if cache_path is not None:
+                self._write_cache(cache_path, new_points)
+
+        grid = np.array([[points[f"{f}:{n}"] for f in range(len(folds))] for n in train_size])
+        train_score = grid[:, :, 0].mean(axis=1)
+        val_score = grid[:, :, 1].mean(axis=1)
 
         # return 
         self._lc = [train_size, train_score, val_score]
@@ -367,8 +1210,10 @@ class LearningCurve:
 
     def make_dataframe(self): 
         """Making the dataframe from learning curve results"""
-        # Get the data 
-        train_size, train_score, val_score = self.learning_curve()
+        # Get the data, computed once per instance
+        if self.get_data("lc") is None:
+            self.learning_curve()
+        train_size, train_score, val_score = self.get_data("lc")
         # Making the dataframe 
         lc = pd.DataFrame(
             {
@@ -445,7 +1290,9 @@ class TestPredicter:
     # making predictions 
     def predict(self):
         """Gets the data and makes a  prediction"""
-        pred = self.model.predict(self.test_data)
+        with timed("amos_predict_seconds", "Seconds per batch prediction", caller="test"):
+            pred = self.model.predict(self.test_data)
+        count("amos_rows_predicted_total", len(self.test_data), "Rows scored", caller="test")
         self._df_prediction = pred
         return pred
     # prediction function
@@ -479,3 +1326,123 @@ class TestPredicter:
     def __repr__(self):
         return f"TestMapper on {self.filepath}"  
 
+
+
+# set in every scoring process by `_init_scorer`
+_SCORER = {}
+
+def _init_scorer(model, transform):
+    _SCORER["model"] = model
+    _SCORER["transform"] = transform
+
+def _score_chunk(chunk, model=None, transform=None):
+    """Id -> SalePrice frame of one chunk of raw rows"""
+    model = model if model is not None else _SCORER["model"]
+    transform = transform if transform is not None else _SCORER["transform"]
+    pred = model.predict(transform(chunk))
+    return pd.DataFrame({"SalePrice": pred}, index=chunk.index)
+
+# Streaming predictions
+class StreamingPredicter:
+    """Score input files that do not fit in memory, chunk by chunk
+    - Reads csv or parquet input, writes csv or parquet output as chunks
+      are scored, so memory is bounded by the chunk size
+    - With n_jobs > 1 chunks are scored in a process pool, at most
+      2 * n_jobs chunks are in flight
+    """
+    def __init__(self, model, transform, chunksize=50_000, n_jobs=1):
+        """
+        Parameters:
+            model: model 
+                -> trained model 
+            transform: callable
+                -> picklable function turning raw rows into the model
+                   feature matrix, eg. a fitted FeatureTransformer
+            chunksize: int
+                -> rows per chunk
+            n_jobs: int
+                -> scoring processes, 1 scores in this process
+        """
+        self.model = model
+        self.transform = transform
+        self.chunksize = chunksize
+        self.n_jobs = n_jobs
+
+    def read_chunks(self, input_path):
+        """Yield raw chunks indexed by Id"""
+        input_path = Path(input_path)
+        if input_path.suffix == ".parquet":
+            from pyarrow import parquet
+            for batch in parquet.ParquetFile(input_path).iter_batches(batch_size=self.chunksize):
+                chunk = batch.to_pandas().set_index("Id")
+                # missing strings come back as None, the imputers expect NaN
+                yield chunk.where(chunk.notna(), np.nan)
+        else:
+            yield from (
+                chunk.set_index("Id")
+                for chunk in pd.read_csv(input_path, dtype=_stream_dtypes(), chunksize=self.chunksize)
+            )
+
+    def _scored_chunks(self, chunks):
+        """Yield scored chunks in input order"""
+        if self.n_jobs == 1:
+            for chunk in chunks:
+                yield _score_chunk(chunk, self.model, self.transform)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self.n_jobs,
+            initializer=_init_scorer,
+            initargs=(self.model, self.transform)
+        ) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_score_chunk, chunk))
+                if len(pending) >= 2 * self.n_jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def predict_file(self, input_path, output_path):
+        """Score input_path into output_path and report the throughput
+        Returns:
+            dict with rows, seconds, rows_per_s and the peak RSS (MB) of
+            this process and of the scoring processes
+        """
+        output_path = Path(output_path)
+        output_path.unlink(missing_ok=True)
+        writer = None
+        rows = 0
+        start = time.perf_counter()
+        try:
+            for i, scored in enumerate(self._scored_chunks(self.read_chunks(input_path))):
+                if output_path.suffix == ".parquet":
+                    import pyarrow as pa
+                    from pyarrow import parquet
+                    table = pa.Table.from_pandas(scored)
+                    if writer is None:
+                        writer = parquet.ParquetWriter(output_path, table.schema)
+                    writer.write_table(table)
+                else:
+                    scored.to_csv(output_path, mode="a", header=i == 0)
+                rows += len(scored)
+        finally:
+            if writer is not None:
+                writer.close()
+        seconds = time.perf_counter() - start
+
+        # ru_maxrss is in kilobytes on Linux
+        stats = {
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_s": rows / seconds if seconds else float("nan"),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        }
+        logging.info(f"Scored {rows} rows in {seconds:.2f}s ({stats['rows_per_s']:.0f} rows/s)")
+        count("amos_rows_predicted_total", rows, "Rows scored", caller="stream")
+        self._stats = stats
+        return stats
+
+    def __repr__(self):
+        return f"StreamingPredicter chunksize={self.chunksize} n_jobs={self.n_jobs}"
@@ -0,0 +1,356 @@
+# Important libraries
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import joblib
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.stats import loguniform, randint
+from sklearn.base import clone
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold, ParameterSampler
+
+import Training
+from Training import MODEL_PARAMS, MODEL_PARAMS_FILE, MakePipeline, frame_fingerprint, load_model_params
+
+# Hyperparameter distributions per model type (per backend for gradient)
+SEARCH_SPACES = {
+    "tree": {
+        "max_depth": randint(3, 16),
+        "min_samples_split": randint(2, 20),
+        "min_samples_leaf": randint(1, 10)
+    },
+    "forest": {
+        "n_estimators": randint(30, 200),
+        "max_depth": [6, 8, 10, 14, None],
+        "min_samples_split": randint(2, 10),
+        "min_samples_leaf": randint(1, 5),
+        "max_features": [1.0, 0.5, "sqrt"]
+    },
+    "gradient": {
+        "exact": {
+            "n_estimators": randint(50, 400),
+            "learning_rate": loguniform(0.02, 0.3),
+            "max_depth": randint(2, 5),
+            "min_samples_split": randint(2, 10),
+            "subsample": [1.0, 0.8]
+        },
+        "hist": {
+            "learning_rate": loguniform(0.03, 0.3),
+            "max_leaf_nodes": [7, 15, 31],
+            "min_samples_leaf": randint(3, 30),
+            "l2_regularization": [0.0, 0.1, 1.0]
+        }
+    }
+}
+
+MAKE_PIPELINE = {
+    "linear": "make_linear_pipeline",
+    "tree": "make_decision_tree_pipeline",
+    "forest": "make_random_forest_pipeline",
+    "gradient": "make_gradient_boosting_pipeline"
+}
+
+
+def _plain(params):
+    """numpy scalars -> python values, so that params are JSON friendly"""
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in params.items()}
+
+
+def _tuning_trial(head, params, Xt_train, y_train, Xt_val, y_val, n):
+    """Fit a copy of the model head on the first n training rows of a fold"""
+    model = clone(head).set_params(**params)
+    start = time.perf_counter()
+    model.fit(Xt_train[:n], y_train[:n])
+    return r2_score(y_val, model.predict(Xt_val)), time.perf_counter() - start
+
+
+class ParamTuner:
+    """Successive halving search over the hyperparameters of one model type
+    - Random candidates (plus the current params) are scored with k-fold
+      cross validation on a small number of rows; the best 1/factor move
+      on to the next rung with factor times more rows, up to the full folds
+    - Every fold is preprocessed once (the `preprocess` step fitted on the
+      fold training rows) and kept on disk, trial fits only refit the head
+      and run in a joblib process pool on the memory mapped folds
+    - Every trial score is appended to a JSON lines file, a rerun with the
+      same data and settings only fits the missing trials
+
+    Parameters:
+        model_type: str
+            -> tree, forest or gradient (the backend of MODEL_PARAMS)
+        n_candidates: int
+            -> random candidates of the first rung
+        factor: int
+            -> fraction of candidates kept and growth of the rows per rung
+        cv: int
+            -> number of folds
+        min_resources: int
+            -> training rows of the first rung
+        n_jobs: int
+            -> parallel trial fits, by default at most 4
+        cache_dir: str/Path object
+            -> where the preprocessed folds and the trials are kept
+        random_state: int
+            -> seed of the folds and of the candidate sampling
+    """
+    def __init__(
+        self,
+        model_type,
+        n_candidates=27,
+        factor=3,
+        cv=5,
+        min_resources=100,
+        n_jobs=None,
+        cache_dir=Path.cwd() / ".cache" / "tuning",
+        random_state=42
+    ):
+        if model_type not in SEARCH_SPACES:
+            raise ValueError(f"No search space for the {model_type} model")
+        self.model_type = model_type
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.cv = cv
+        self.min_resources = min_resources
+        self.n_jobs = n_jobs if n_jobs is not None else min(4, os.cpu_count() or 1)
+        self.cache_dir = Path(cache_dir)
+        self.random_state = random_state
+
+    @property
+    def backend(self):
+        return MODEL_PARAMS["gradient"]["backend"] if self.model_type == "gradient" else None
+
+    def space(self):
+        """Search space of the model (and backend)"""
+        space = SEARCH_SPACES[self.model_type]
+        return space[self.backend] if self.backend else space
+
+    def pipeline(self, X):
+        """Unfitted pipeline with the current MODEL_PARAMS"""
+        return getattr(MakePipeline(X), MAKE_PIPELINE[self.model_type])()
+
+    def candidates(self, head):
+        """The current params of the head followed by random samples of the space"""
+        space = self.space()
+        current = {key: value for key, value in head.get_params().items() if key in space}
+        sampled = ParameterSampler(space, n_iter=self.n_candidates - 1, random_state=self.random_state)
+        return [_plain(current)] + [_plain(params) for params in sampled]
+
+    def rungs(self, n_max):
+        """(candidates kept, training rows) of every rung"""
+        # counted in integers, math.log(243, 3) is 4.999...
+        n_rungs = 1
+        while self.factor ** n_rungs <= self.n_candidates:
+            n_rungs += 1
+        rungs = []
+        for i in range(n_rungs):
+            rows = n_max // self.factor ** (n_rungs - 1 - i)
+            kept = -(-self.n_candidates // self.factor ** i)
+            rungs.append((kept, min(n_max, max(self.min_resources, rows))))
+        return rungs
+
+    def folds(self, X, y, pipeline):
+        """Preprocessed (Xt_train, y_train, Xt_val, y_val) of every fold
+        - The training rows of a fold are shuffled once, so a rung with n
+          rows trains on a prefix of them
+        - Stored with joblib and loaded memory mapped
+        """
+        preprocess = pipeline.named_steps["preprocess"]
+        key = hashlib.sha1(
+            f"{frame_fingerprint(X)}:{frame_fingerprint(y)}:{joblib.hash(clone(preprocess))}:"
+            f"{self.cv}:{self.random_state}".encode()
+        ).hexdigest()
+        path = self.cache_dir / "folds" / f"{key}.joblib"
+        if path.exists():
+            return key, joblib.load(path, mmap_mode="r")
+
+        logging.info(f"Preprocessing {self.cv} folds for tuning")
+        y = np.asarray(y)
+        folds = []
+        splits = KFold(n_splits=self.cv, shuffle=True, random_state=self.random_state).split(X)
+        for fold, (train, val) in enumerate(splits):
+            train = np.random.RandomState(self.random_state + fold).permutation(train)
+            fitted = clone(preprocess).fit(X.iloc[train], y[train])
+            folds.append((fitted.transform(X.iloc[train]), y[train], fitted.transform(X.iloc[val]), y[val]))
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        joblib.dump(folds, tmp_path)
+        os.replace(tmp_path, path)
+        return key, joblib.load(path, mmap_mode="r")
+
+    def trials_path(self, folds_key, head):
+        """Trials file of the folds and the params that are not searched
+        - Saving tuned params does not change it, so reruns still resume
+        """
+        fixed = {key: value for key, value in head.get_params().items() if key not in self.space()}
+        key = hashlib.sha1(
+            f"{folds_key}:{type(head).__name__}:{joblib.hash(fixed)}:{self.backend}".encode()
+        ).hexdigest()
+        return self.cache_dir / f"trials-{self.model_type}-{key[:16]}.jsonl"
+
+    @staticmethod
+    def trial_id(params, rows, fold):
+        return hashlib.sha1(json.dumps([params, rows, fold], sort_keys=True).encode()).hexdigest()
+
+    def read_trials(self, path):
+        """Scores already computed, keyed by trial id"""
+        trials = {}
+        if path.exists():
+            for line in path.read_text().splitlines():
+                try:
+                    trial = json.loads(line)
+                except json.JSONDecodeError:
+                    # a run stopped while writing its last line
+                    continue
+                trials[trial["trial"]] = trial
+        return trials
+
+    def search(self, X, y):
+        """Run (or resume) the search
+        Returns:
+            dict with the best params, their mean R2 on the full folds, the
+            rungs and the number of trials fitted by this run
+        """
+        pipeline = self.pipeline(X)
+        head = pipeline.steps[-1][1]
+        folds_key, folds = self.folds(X, y, pipeline)
+        path = self.trials_path(folds_key, head)
+        trials = self.read_trials(path)
+
+        n_max = min(len(fold[1]) for fold in folds)
+        candidates = self.candidates(head)
+        fitted = 0
+        rungs = []
+        for keep, rows in self.rungs(n_max):
+            candidates = candidates[:keep]
+            tasks = [(i, fold) for i in range(len(candidates)) for fold in range(len(folds))]
+            missing = [
+                (i, fold) for i, fold in tasks
+                if self.trial_id(candidates[i], rows, fold) not in trials
+            ]
+            logging.info(f"Tuning {self.model_type}: {len(candidates)} candidates on {rows} rows, "
+                         f"{len(missing)} trials to fit, {len(tasks) - len(missing)} cached")
+
+            results = Parallel(n_jobs=self.n_jobs, return_as="generator")(
+                delayed(_tuning_trial)(head, candidates[i], folds[fold][0], folds[fold][1],
+                                       folds[fold][2], folds[fold][3], rows)
+                for i, fold in missing
+            )
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("a") as trials_file:
+                for (i, fold), (score, seconds) in zip(missing, results):
+                    trial = {
+                        "trial": self.trial_id(candidates[i], rows, fold),
+                        "params": candidates[i],
+                        "rows": rows,
+                        "fold": fold,
+                        "score": score,
+                        "seconds": round(seconds, 4)
+                    }
+                    trials[trial["trial"]] = trial
+                    # flushed per trial so that an interrupted run resumes here
+                    trials_file.write(json.dumps(trial) + "\n")
+                    trials_file.flush()
+                    fitted += 1
+
+            scores = [
+                np.mean([trials[self.trial_id(params, rows, fold)]["score"] for fold in range(len(folds))])
+                for params in candidates
+            ]
+            order = np.argsort(scores, kind="stable")[::-1]
+            candidates = [candidates[i] for i in order]
+            rungs.append({"candidates": len(scores), "rows": rows, "best_score": float(np.max(scores))})
+
+        return {
+            "model_type": self.model_type,
+            "backend": self.backend,
+            "best_params": candidates[0],
+            "best_score": rungs[-1]["best_score"],
+            "rungs": rungs,
+            "trials_fitted": fitted,
+            "trials_file": str(path)
+        }
+
+    def __repr__(self):
+        return f"ParamTuner model_type={self.model_type} n_candidates={self.n_candidates} factor={self.factor}"
+
+
+def save_model_params(results, path=MODEL_PARAMS_FILE):
+    """Write tuned params into the versioned config read by MakePipeline
+    - The version goes up by one on every write, the other models keep
+      their entries
+    - MODEL_PARAMS of this process is updated as well
+
+    Parameters:
+        results: list
+            -> ParamTuner.search results
+    """
+    path = Path(path)
+    try:
+        config = json.loads(path.read_text())
+    except FileNotFoundError:
+        config = {"version": 0, "params": {}, "tuning": {}}
+
+    for result in results:
+        model_type, backend = result["model_type"], result["backend"]
+        if backend:
+            config["params"].setdefault(model_type, {})[backend] = result["best_params"]
+            name = f"{model_type}:{backend}"
+        else:
+            config["params"][model_type] = result["best_params"]
+            name = model_type
+        config["tuning"][name] = {
+            "cv_r2": result["best_score"],
+            "rungs": result["rungs"],
+            "updated": datetime.now(timezone.utc).isoformat()
+        }
+    config["version"] += 1
+
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(config, indent=2, sort_keys=True) + "\n")
+    os.replace(tmp_path, path)
+    Training.MODEL_PARAMS_VERSION = load_model_params(path)
+    return config["version"]
+
+
+def main(argv=None):
+    """Tune the models and write the best params, eg.:
+        python Tuning.py tree forest gradient --candidates 27 --jobs 4
+    """
+    parser = argparse.ArgumentParser(description="Successive halving search of the model hyperparameters")
+    parser.add_argument("models", nargs="*", default=list(SEARCH_SPACES), choices=list(SEARCH_SPACES))
+    parser.add_argument("--candidates", type=int, default=27)
+    parser.add_argument("--factor", type=int, default=3)
+    parser.add_argument("--cv", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--config", type=Path, default=MODEL_PARAMS_FILE,
+                        help="versioned params file read by MakePipeline")
+    parser.add_argument("--dry-run", action="store_true", help="do not write the config")
+    args = parser.parse_args(argv)
+
+    # imported here, Business depends on Training
+    from Business import model_registry
+    X, y = model_registry.training_data()
+
+    results = []
+    for model_type in args.models:
+        tuner = ParamTuner(model_type, n_candidates=args.candidates, factor=args.factor,
+                           cv=args.cv, n_jobs=args.jobs)
+        results.append(tuner.search(X, y))
+        print(json.dumps(results[-1], indent=2))
+
+    if not args.dry_run:
+        version = save_model_params(results, args.config)
+        print(f"Wrote version {version} of {args.config}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
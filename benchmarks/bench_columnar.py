@@ -0,0 +1,66 @@
+"""Compare loading the Kaggle csv files: cold csv parsing vs. the columnar caches
+
+    python benchmarks/bench_columnar.py [--repeat 5]
+"""
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import pandas as pd
+import Training
+from Training import read_raw
+
+
+def timed(func, repeat):
+    """Median seconds of `func` over `repeat` runs"""
+    runs = []
+    for _ in range(repeat):
+        # drop the in-process frames so every run hits the disk path
+        Training._RAW_FRAMES.clear()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for file_name in ["train.csv", "test.csv"]:
+            filepath = Path(tmp) / file_name
+            shutil.copy(ROOT / file_name, filepath)
+
+            results = {
+                "csv (inferred dtypes)": timed(lambda: pd.read_csv(filepath), args.repeat),
+                "csv (pinned dtypes)": timed(lambda: read_raw(filepath), args.repeat)
+            }
+            formats = ["npy"]
+            try:
+                import pyarrow  # noqa: F401
+                formats.insert(0, "feather")
+            except ImportError:
+                print("pyarrow is not installed, skipping feather")
+            for columnar in formats:
+                # the first read writes the sidecar file
+                Training._RAW_FRAMES.clear()
+                read_raw(filepath, columnar=columnar)
+                label = "feather (memory mapped)" if columnar == "feather" else "npy (mmap)"
+                results[label] = timed(lambda: read_raw(filepath, columnar=columnar), args.repeat)
+
+            print(file_name)
+            for label, seconds in results.items():
+                print(f"  {label:25} {1000 * seconds:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare the gradient boosting engines: exact (one-hot) vs. hist (native categoricals)
+
+    python benchmarks/bench_gradient.py [--repeat 50] [--folds 5]
+
+Select the engine used by the app with AMOS_GRADIENT_BACKEND=exact|hist.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from sklearn.metrics import r2_score
+from sklearn.model_selection import KFold, train_test_split
+
+from Business import model_registry
+from Training import GRADIENT_PARAMS, MakePipeline
+
+
+def timed(func, repeat):
+    """Median seconds of `func` over `repeat` runs"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def cv_r2(backend, X, y, folds):
+    """Mean validation R2 over k folds"""
+    scores = []
+    for train, val in KFold(n_splits=folds, shuffle=True, random_state=42).split(X):
+        model = MakePipeline(X.iloc[train]).make_gradient_boosting_pipeline(backend=backend)
+        model.fit(X.iloc[train], y.iloc[train])
+        scores.append(r2_score(y.iloc[val], model.predict(X.iloc[val])))
+    return statistics.mean(scores)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--folds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    X, y = model_registry.training_data()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    print(f"{'backend':8} {'fit s':>7} {'iters':>6} {'1 row ms':>9} {'batch ms':>9} {'test R2':>8} {'cv R2':>7}")
+    for backend in GRADIENT_PARAMS:
+        model = MakePipeline(X_train).make_gradient_boosting_pipeline(backend=backend)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+
+        head = model.named_steps["gradient_model"]
+        iters = getattr(head, "n_iter_", getattr(head, "n_estimators_", None))
+        one_row = 1000 * timed(lambda: model.predict(X_test.iloc[:1]), args.repeat)
+        batch = 1000 * timed(lambda: model.predict(X_test), args.repeat)
+        test_r2 = r2_score(y_test, model.predict(X_test))
+        print(f"{backend:8} {fit_seconds:7.3f} {iters:6d} {one_row:9.2f} {batch:9.2f} "
+              f"{test_r2:8.4f} {cv_r2(backend, X, y, args.folds):7.4f}")
+    print(f"batch = {len(X_test)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Parity and latency of the compiled NumPy scorers against sklearn
+
+    python benchmarks/bench_inference.py [--repeat 200]
+
+Exits with an error if a compiled scorer does not reproduce
+Pipeline.predict on train.csv and test.csv.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+
+from Business import model_registry
+from Inference import CompiledPipeline, record_columns
+from Service import IDMapping
+from Training import MODEL_PARAMS
+
+
+def latency(func, repeat):
+    """Median milliseconds of func()"""
+    func()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return 1000 * float(np.median(runs))
+
+
+def check_parity(model_type, transformer, frames):
+    """Assert the compiled scorer matches sklearn on the given raw frames"""
+    model, X_train, y_train = model_registry.get_model(model_type)
+    compiled = CompiledPipeline(model)
+    for name, raw in frames.items():
+        expected = model.predict(transformer.transform(raw))
+        records = json.loads(raw.reset_index().to_json(orient="records"))
+        got = compiled.predict(transformer.transform_columns(record_columns(records, transformer.selected_columns_)))
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-6,
+                                   err_msg=f"{model_type} on {name}")
+    return model, compiled
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    model_registry.warm_start()
+    transformer = model_registry.feature_transformer()
+    test = IDMapping().repo.wrangle()
+    train = pd.read_csv(ROOT / "train.csv").set_index("Id").drop(columns="SalePrice")
+    records = json.loads(test.reset_index().to_json(orient="records"))
+
+    print(f"{'model':10} {'batch':>6} {'sklearn ms':>11} {'compiled ms':>12} {'speedup':>8}")
+    for model_type in MODEL_PARAMS:
+        model, compiled = check_parity(model_type, transformer, {"train.csv": train, "test.csv": test})
+        for batch in [1, 10, 100, 1000]:
+            raw, batch_records = test.iloc[:batch], records[:batch]
+            sk = latency(lambda: model.predict(transformer.transform(raw)), args.repeat)
+            fast = latency(lambda: compiled.predict(transformer.transform_columns(
+                record_columns(batch_records, transformer.selected_columns_))), args.repeat)
+            print(f"{model_type:10} {batch:6d} {sk:11.3f} {fast:12.3f} {sk / fast:7.1f}x")
+    print("parity: compiled predictions match sklearn on train.csv and test.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Memory of the wrangling stages: default dtypes vs. compact mode
+
+    python benchmarks/bench_memory.py [--scales 1 10]
+
+For every stage prints the bytes with the default dtypes and with
+`compact_frame` dtypes, then the bytes the repository still holds once the
+intermediate stages are dropped, and the test R2 of the linear and tree
+models trained on both frames. Turn the mode on in the app with
+AMOS_COMPACT_MEMORY=1.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+
+from Service import sub_class
+from Training import MakePipeline, WrangleRepository
+from synthetic import make_scaled
+
+
+def wrangle(path, **kwargs):
+    """Repository with every stage computed, and the seconds it took"""
+    repo = WrangleRepository(sub_class=sub_class, root_path=path.parent, file_name=path.name, **kwargs)
+    start = time.perf_counter()
+    repo.wrangle()
+    repo.basic_cleaning()
+    repo.feature_selection()
+    repo.feature_engineering()
+    repo.remove_outliers(columns=["HouseAge"])
+    return repo, time.perf_counter() - start
+
+
+def test_r2(df, model_type):
+    X, y = df.drop(columns="SalePrice"), df["SalePrice"]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    pipe = MakePipeline(X_train)
+    model = {"linear": pipe.make_linear_pipeline, "tree": pipe.make_decision_tree_pipeline}[model_type]()
+    model.fit(X_train, y_train)
+    return r2_score(y_test, model.predict(X_test))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10])
+    args = parser.parse_args(argv)
+
+    for scale in args.scales:
+        path = ROOT / "train.csv" if scale == 1 else make_scaled(scale)
+        default, default_s = wrangle(path, compact=False)
+        compact, compact_s = wrangle(path, compact=True, keep_stages=WrangleRepository.stages)
+        released, released_s = wrangle(path, compact=True)
+
+        before = default.memory_report()
+        after = compact.memory_report()
+        print(f"\nx{scale}: {before['rows'].iloc[0]:,} rows")
+        print(f"{'stage':12} {'default MB':>11} {'compact MB':>11} {'ratio':>6}")
+        for stage in before.index:
+            b, a = before.loc[stage, "bytes"] / 2**20, after.loc[stage, "bytes"] / 2**20
+            print(f"{stage:12} {b:11.2f} {a:11.2f} {b / a:6.1f}")
+
+        held = released.memory_report()
+        held = held.loc[held["held"], "bytes"].sum() / 2**20
+        print(f"{'held':12} {before['bytes'].sum() / 2**20:11.2f} {held:11.2f} {before['bytes'].sum() / 2**20 / held:6.1f}"
+              "   (all stages vs. compact with dropped stages)")
+        print(f"{'wrangle s':12} {default_s:11.2f} {released_s:11.2f}")
+
+        for model_type in ("linear", "tree"):
+            print(f"{model_type + ' R2':12} {test_r2(default.get_data(), model_type):11.4f} "
+                  f"{test_r2(released.get_data(), model_type):11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Dense vs. sparse preprocessing on wide, high-cardinality data
+
+    python benchmarks/bench_sparse.py [--scale 10] [--extra 20] [--levels 2000]
+
+The data is split first, then only the training rows are scaled up, so no
+copy of a test row is seen in training. Both parts get `--extra` categorical
+columns with up to `--levels` Zipf distributed categories (noise for the
+models). Each
+preprocessing mode is timed and its peak traced memory reported:
+    dense    ColumnTransformer forced to a dense matrix (sparse_threshold=0)
+    default  MakePipeline as the app runs it, format picked by density
+    sparse   AMOS_SPARSE_PREPROCESS mode, CSR end to end, rare categories
+             collapsed (see Training.SPARSE_PARAMS)
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.tree import DecisionTreeRegressor
+
+from Business import model_registry
+from Training import MODEL_PARAMS, MakePipeline
+
+
+def wide_frame(X, y, scale, extra, levels, random_state=42):
+    """Rows repeated scale times plus extra high-cardinality columns"""
+    rng = np.random.default_rng(random_state)
+    X = pd.concat([X] * scale, ignore_index=True)
+    y = pd.concat([y] * scale, ignore_index=True)
+    for j in range(extra):
+        n_levels = int(np.geomspace(20, levels, extra)[j])
+        codes = np.minimum(rng.zipf(1.3, size=len(X)), n_levels)
+        X[f"Extra{j}"] = pd.Series(codes).map(lambda code, j=j: f"e{j}_{code}").astype(object)
+    return X, y
+
+
+def matrix_mb(Xt):
+    if sparse.issparse(Xt):
+        return (Xt.data.nbytes + Xt.indices.nbytes + Xt.indptr.nbytes) / 2**20
+    return Xt.nbytes / 2**20
+
+
+def measure(func):
+    """(result, seconds, peak traced MB) of func()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--extra", type=int, default=20)
+    parser.add_argument("--levels", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    X, y = model_registry.training_data()
+    # split before scaling, copies of a test row must not end up in training
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, y_train = wide_frame(X_train, y_train, args.scale, args.extra, args.levels)
+    X_test, y_test = wide_frame(X_test, y_test, 1, args.extra, args.levels, random_state=43)
+    print(f"{len(X_train):,} training rows, {len(X_test):,} test rows, {X_train.shape[1]} columns, "
+          f"{X_train.select_dtypes(include='object').nunique().sum():,} categories")
+
+    modes = {
+        "dense": lambda: MakePipeline(X_train, sparse=False).make_column_pipeline().set_params(sparse_threshold=0),
+        "default": lambda: MakePipeline(X_train, sparse=False).make_column_pipeline(),
+        "sparse": lambda: MakePipeline(X_train, sparse=True).make_column_pipeline()
+    }
+    heads = {
+        "linear": LinearRegression(**MODEL_PARAMS["linear"]),
+        "tree": DecisionTreeRegressor(**MODEL_PARAMS["tree"])
+    }
+
+    print(f"\n{'mode':8} {'step':12} {'seconds':>8} {'peak MB':>8} {'matrix MB':>10} {'columns':>8} {'test R2':>8}")
+    for mode, make in modes.items():
+        col_pipeline = make()
+        Xt, seconds, peak = measure(lambda: col_pipeline.fit_transform(X_train))
+        Xt_test = col_pipeline.transform(X_test)
+        print(f"{mode:8} {'preprocess':12} {seconds:8.2f} {peak:8.1f} {matrix_mb(Xt):10.1f} {Xt.shape[1]:8}")
+
+        for name, head in heads.items():
+            model, seconds, peak = measure(lambda: clone(head).fit(Xt, y_train))
+            score = r2_score(y_test, model.predict(Xt_test))
+            print(f"{mode:8} {name:12} {seconds:8.2f} {peak:8.1f} {'':10} {'':8} {score:8.4f}")
+
+        # the 1-D projection of the PCA plot
+        pca = TruncatedSVD(n_components=1, random_state=42) if sparse.issparse(Xt) else PCA(n_components=1, random_state=42)
+        _, seconds, peak = measure(lambda: pca.fit(Xt))
+        print(f"{mode:8} {type(pca).__name__:12} {seconds:8.2f} {peak:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
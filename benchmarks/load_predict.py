@@ -0,0 +1,85 @@
+"""Load test the /predict endpoint and report latency percentiles
+
+    python benchmarks/load_predict.py                       # in process
+    python benchmarks/load_predict.py --url http://localhost:8000/predict
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+
+
+def make_sender(url):
+    """Function posting one JSON payload, to a url or the in-process app"""
+    if url:
+        def send(payload):
+            req = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req) as response:
+                assert response.status == 200
+        return send
+
+    from Presentation import server
+    from Business import model_registry
+    model_registry.warm_start()
+    client = server.test_client()
+
+    def send(payload):
+        response = client.post("/predict", json=payload)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return send
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=None, help="endpoint of a running server")
+    parser.add_argument("--model", default="linear")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--batch", type=int, default=1, help="records per request")
+    args = parser.parse_args(argv)
+
+    test = pd.read_csv(ROOT / "test.csv")
+    records = json.loads(test.to_json(orient="records"))
+    send = make_sender(args.url)
+
+    # warm up
+    for i in range(20):
+        send({"model": args.model, "records": records[i:i + args.batch]})
+
+    latencies = []
+    def worker(n):
+        for i in range(n):
+            start = i * args.batch % (len(records) - args.batch)
+            payload = {"model": args.model, "records": records[start:start + args.batch]}
+            t = time.perf_counter()
+            send(payload)
+            latencies.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=worker, args=(args.requests // args.threads,))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    ms = 1000 * np.array(latencies)
+    print(f"{len(ms)} requests, {args.threads} threads, {args.batch} records each, model {args.model}")
+    print(f"  throughput {len(ms) / seconds:.0f} req/s")
+    print(f"  p50 {np.percentile(ms, 50):.2f} ms  p95 {np.percentile(ms, 95):.2f} ms  "
+          f"p99 {np.percentile(ms, 99):.2f} ms  max {ms.max():.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
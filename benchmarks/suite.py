@@ -0,0 +1,263 @@
+"""End-to-end benchmark suite: wrangling, training, learning curves, figures and callbacks
+
+    python benchmarks/suite.py                      # train.csv and a 10x copy
+    python benchmarks/suite.py --scales 1 10 100    # scaling curve, 100x takes a while
+    python benchmarks/suite.py --only wrangle models --compare benchmarks/results/<old>.json
+
+Every measurement is the median of --repeat runs, stored with the commit
+in benchmarks/results/<date>-<commit>.json; --compare prints the ratio to
+an older result file and flags slowdowns above --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import numpy as np
+import sklearn
+
+import Training
+from Training import WrangleRepository, MakePipeline, LearningCurve, MODEL_PARAMS
+from Service import GetModel, sub_class
+from synthetic import make_scaled
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+
+def measure(func, repeat, setup=None):
+    """Median and min seconds of func() over repeat runs, setup() runs untimed first"""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {"seconds": statistics.median(runs), "min": min(runs), "repeat": repeat}
+
+
+def data_file(scale):
+    return ROOT / "train.csv" if scale == 1 else make_scaled(scale)
+
+
+def wrangled_repo(path):
+    """A repository with every stage computed, outliers as in GetData.training_data"""
+    repo = WrangleRepository(sub_class=sub_class, root_path=path.parent, file_name=path.name)
+    repo.wrangle()
+    repo.basic_cleaning()
+    repo.feature_selection()
+    repo.feature_engineering()
+    repo.remove_outliers(columns=["HouseAge"])
+    return repo
+
+
+def bench_wrangle(scales, repeat):
+    """Every WrangleRepository stage, starting from a cold csv read"""
+    results = {}
+    stages = [
+        ("wrangled", lambda repo: repo.wrangle()),
+        ("basic", lambda repo: repo.basic_cleaning()),
+        ("selected", lambda repo: repo.feature_selection()),
+        ("engineered", lambda repo: repo.feature_engineering()),
+        ("outlier", lambda repo: repo.remove_outliers(columns=["HouseAge"]))
+    ]
+    for scale in scales:
+        path = data_file(scale)
+        runs = {stage: [] for stage, run in stages}
+        for _ in range(repeat):
+            Training._RAW_FRAMES.clear()
+            repo = WrangleRepository(sub_class=sub_class, root_path=path.parent, file_name=path.name)
+            for stage, run in stages:
+                start = time.perf_counter()
+                run(repo)
+                runs[stage].append(time.perf_counter() - start)
+        for stage, seconds in runs.items():
+            results[f"wrangle/x{scale}/{stage}"] = {
+                "seconds": statistics.median(seconds), "min": min(seconds), "repeat": repeat
+            }
+    return results
+
+
+def bench_models(scales, repeat):
+    """Shared preprocessing, every model head fit, batch and single row predict"""
+    results = {}
+    for scale in scales:
+        df = wrangled_repo(data_file(scale)).get_data()
+        X, y = df.drop(columns="SalePrice"), df["SalePrice"]
+        results[f"models/x{scale}/preprocess"] = measure(
+            lambda: MakePipeline(X).preprocess(), repeat, setup=Training._PREPROCESSED.clear
+        )
+        for model_type in MODEL_PARAMS:
+            build = getattr(GetModel(X_train=X), f"build_{model_type}_model")
+            model = MakePipeline(X).fit_shared(build(), y)
+            results[f"models/x{scale}/{model_type}/fit"] = measure(
+                lambda: MakePipeline(X).fit_shared(build(), y), repeat
+            )
+            results[f"models/x{scale}/{model_type}/predict_batch"] = measure(lambda: model.predict(X), repeat)
+            results[f"models/x{scale}/{model_type}/predict_row"] = measure(lambda: model.predict(X.iloc[:1]), 5 * repeat)
+        results[f"models/x{scale}/rows"] = {"value": len(X)}
+    return results
+
+
+def bench_learning_curves(repeat):
+    """LearningCurve.learning_curve of every model on train.csv, without the disk cache"""
+    df = wrangled_repo(data_file(1)).get_data()
+    X, y = df.drop(columns="SalePrice"), df["SalePrice"]
+    results = {}
+    for model_type in MODEL_PARAMS:
+        model = getattr(GetModel(X_train=X), f"build_{model_type}_model")()
+        results[f"learning_curve/{model_type}"] = measure(
+            lambda: LearningCurve(estimator=model, X=X, y=y, cache_dir=None).learning_curve(), repeat
+        )
+    return results
+
+
+def bench_figures(repeat):
+    """Every GraphBuilder figure: rendered, and served from the figure cache"""
+    from Business import GraphBuilder, model_registry
+    model_registry.warm_start()
+    results = {}
+    for name, args in GraphBuilder().figure_calls():
+        label = "/".join([name, *args])
+        results[f"figures/render/{label}"] = measure(lambda: getattr(GraphBuilder(use_cache=False), name)(*args), repeat)
+        getattr(GraphBuilder(), name)(*args)
+        results[f"figures/cached/{label}"] = measure(lambda: getattr(GraphBuilder(as_dict=True), name)(*args), 5 * repeat)
+    return results
+
+
+def callback_body(app, output, inputs, state=(), changed=None):
+    """Body of a Dash callback request, as the browser would send it
+    - output: part of the callback output key, eg. "plots-container.children"
+    """
+    key = next(key for key in app.callback_map if output in key)
+    outputs = [
+        {"id": output.split(".", 1)[0], "property": output.split(".", 1)[1]}
+        for output in key.strip(".").split("...")
+    ]
+    as_props = lambda items: [{"id": i, "property": p, "value": v} for i, p, v in items]
+    return {
+        "output": key,
+        "outputs": outputs if key.startswith("..") else outputs[0],
+        "inputs": as_props(inputs),
+        "state": as_props(state),
+        "changedPropIds": [changed or f"{inputs[0][0]}.{inputs[0][1]}"]
+    }
+
+
+def bench_callbacks(repeat):
+    """Presentation.py callbacks through the Flask test client (figure cache warm)"""
+    from Presentation import app
+    from Business import GraphBuilder
+    GraphBuilder().warm()
+    client = app.server.test_client()
+
+    def call(body):
+        response = client.post("/_dash-update-component", json=body)
+        if response.status_code not in (200, 204):
+            raise RuntimeError(f"{body['output']}: HTTP {response.status_code} {response.data[:200]}")
+
+    results = {}
+    buttons = ["btn-home", "btn-lc", "btn-fi", "btn-predictions", "btn-residual", "btn-about"]
+    for button in buttons:
+        body = callback_body(
+            app, "plots-container.children",
+            [(b, "n_clicks", 1 if b == button else None) for b in buttons]
+        )
+        results[f"callbacks/render_content/{button}"] = measure(lambda: call(body), repeat)
+
+    for page in ["lc", "fi", "predictions", "residual"]:
+        for tab in MODEL_PARAMS:
+            # render_tab_figure, the only callback writing figure-job
+            body = callback_body(
+                app, "figure-job.data",
+                [("figure-request", "data", {"page": page, "tab": tab})],
+                [("model-tabs", "active_tab", tab)]
+            )
+            results[f"callbacks/render_tab_figure/{page}/{tab}"] = measure(lambda: call(body), repeat)
+
+    body = callback_body(app, "sidebar.className", [("toggle-sidebar", "n_clicks", 1)], [("sidebar", "className", "side-bar")])
+    results["callbacks/toggle_sidebar"] = measure(lambda: call(body), repeat)
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, old_path, threshold):
+    """Print the ratio new/old of every shared measurement"""
+    old = json.loads(Path(old_path).read_text())["results"]
+    print(f"\n{'benchmark':60} {'old s':>9} {'new s':>9} {'ratio':>6}")
+    for name, new in results.items():
+        if "seconds" not in new or name not in old or "seconds" not in old[name]:
+            continue
+        ratio = new["seconds"] / old[name]["seconds"] if old[name]["seconds"] else float("inf")
+        flag = "  <- slower" if ratio > threshold else ""
+        print(f"{name:60} {old[name]['seconds']:9.4f} {new['seconds']:9.4f} {ratio:6.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    groups = ["wrangle", "models", "learning_curves", "figures", "callbacks"]
+    parser.add_argument("--only", nargs="+", choices=groups, default=groups)
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", type=Path, default=None, help="result file, by default in benchmarks/results")
+    parser.add_argument("--compare", type=Path, default=None, help="older result file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio reported as a slowdown")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for group in args.only:
+        start = time.perf_counter()
+        if group == "wrangle":
+            results.update(bench_wrangle(args.scales, args.repeat))
+        elif group == "models":
+            results.update(bench_models(args.scales, args.repeat))
+        elif group == "learning_curves":
+            results.update(bench_learning_curves(1))
+        elif group == "figures":
+            results.update(bench_figures(args.repeat))
+        else:
+            results.update(bench_callbacks(args.repeat))
+        print(f"{group}: {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    for name, result in results.items():
+        value = f"{result['seconds'] * 1000:10.2f} ms" if "seconds" in result else f"{result['value']:>13}"
+        print(f"{name:60} {value}")
+
+    meta = {
+        "commit": commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sklearn": sklearn.__version__,
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "scales": args.scales,
+        "repeat": args.repeat
+    }
+    out = args.out or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{meta['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"meta": meta, "results": results}, indent=2))
+    print(f"\nStored in {out}")
+
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Scaled-up copies of train.csv for the scaling benchmarks
+
+    python benchmarks/synthetic.py 10 100      # writes benchmarks/data/train_x10.csv, ...
+
+Rows are sampled with replacement from train.csv and get new Ids; the
+continuous columns are jittered so that the models do not see exact
+duplicates.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = ROOT / "benchmarks" / "data"
+
+
+def make_scaled(factor, source=ROOT / "train.csv", out_dir=DATA_DIR, random_state=42):
+    """Write (once) a csv with factor times the rows of source, returns its path"""
+    path = Path(out_dir) / f"{Path(source).stem}_x{factor}.csv"
+    if path.exists() and path.stat().st_mtime >= Path(source).stat().st_mtime:
+        return path
+
+    rng = np.random.default_rng(random_state)
+    df = pd.read_csv(source)
+    scaled = df.sample(n=len(df) * factor, replace=True, random_state=random_state).reset_index(drop=True)
+    scaled["Id"] = np.arange(1, len(scaled) + 1)
+
+    # multiplicative noise on continuous columns, years and codes are kept
+    for col in scaled.select_dtypes(include="number").columns:
+        if col == "Id" or "Yr" in col or "Year" in col or df[col].nunique() <= 50:
+            continue
+        noise = rng.lognormal(0, 0.05, size=len(scaled))
+        values = scaled[col] * noise
+        scaled[col] = values.round().astype(df[col].dtype) if pd.api.types.is_integer_dtype(df[col]) else values
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    scaled.to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("factors", nargs="+", type=int)
+    args = parser.parse_args(argv)
+    for factor in args.factors:
+        print(make_scaled(factor))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+# Gunicorn settings, read automatically by `gunicorn app:server`
+from Artifacts import ArtifactStore
+
+
+def on_starting(server):
+    """Train the stale artifacts once in the master, before workers fork"""
+    from Business import ModelRegistry
+    ModelRegistry(store=ArtifactStore()).warm_start()
+
+
+def post_worker_init(worker):
+    """Load the stored pipelines (memory mapped) into the worker registry"""
+    from Business import model_registry
+    model_registry.warm_start()
@@ -0,0 +1,138 @@
+"""Parity of the compiled NumPy scorers (Inference.py) with Pipeline.predict
+
+    python -m pytest tests
+
+Run from the repository root, the data files are read from the working
+directory.
+"""
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pytest
+
+from Business import model_registry
+from Inference import CompiledPipeline, record_columns
+from Service import IDMapping
+from Training import MakePipeline
+
+MAKERS = {
+    "linear": lambda pipe: pipe.make_linear_pipeline(),
+    "tree": lambda pipe: pipe.make_decision_tree_pipeline(),
+    "forest": lambda pipe: pipe.make_random_forest_pipeline(),
+    # the hist backend is served by PipelinePredictor, not compiled
+    "gradient": lambda pipe: pipe.make_gradient_boosting_pipeline(backend="exact")
+}
+
+
+@pytest.fixture(scope="module")
+def transformer():
+    return model_registry.feature_transformer()
+
+
+@pytest.fixture(scope="module")
+def training_data():
+    return model_registry.training_data()
+
+
+@pytest.fixture(scope="module")
+def raw_test():
+    """Raw test.csv rows, as the API receives them"""
+    return IDMapping().repo.wrangle()
+
+
+_FITTED = {}
+
+def fitted(model_type, sparse, training_data):
+    """Pipeline fitted on the training data and its compiled scorer"""
+    if (model_type, sparse) not in _FITTED:
+        X_train, y_train = training_data
+        model = MAKERS[model_type](MakePipeline(X_train, sparse=sparse)).fit(X_train, y_train)
+        _FITTED[model_type, sparse] = model, CompiledPipeline(model)
+    return _FITTED[model_type, sparse]
+
+
+def assert_parity(model, compiled, transformer, raw):
+    """Compiled predictions of the JSON records of raw match model.predict(raw)"""
+    expected = model.predict(transformer.transform(raw))
+    records = json.loads(raw.reset_index().to_json(orient="records"))
+    got = compiled.predict(transformer.transform_columns(record_columns(records, transformer.selected_columns_)))
+    np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-6)
+
+
+def categorical_columns(transformer, raw):
+    return [col for col in transformer.selected_columns_ if raw[col].dtype == object]
+
+
+def numerical_columns(transformer, raw):
+    return [col for col in transformer.selected_columns_ if raw[col].dtype != object]
+
+
+@pytest.mark.parametrize("sparse", [False, True], ids=["default", "sparse"])
+@pytest.mark.parametrize("model_type", list(MAKERS))
+class TestCompiledParity:
+    def test_test_csv(self, model_type, sparse, transformer, training_data, raw_test):
+        assert_parity(*fitted(model_type, sparse, training_data), transformer, raw_test)
+
+    def test_single_record(self, model_type, sparse, transformer, training_data, raw_test):
+        model, compiled = fitted(model_type, sparse, training_data)
+        for i in (0, 7, len(raw_test) - 1):
+            assert_parity(model, compiled, transformer, raw_test.iloc[[i]])
+
+    def test_missing_numerics(self, model_type, sparse, transformer, training_data, raw_test):
+        # NaN in the frame, None (null) in the JSON records
+        raw = raw_test.iloc[:20].copy()
+        columns = numerical_columns(transformer, raw)
+        raw.iloc[::2, [raw.columns.get_loc(col) for col in columns[::2]]] = np.nan
+        raw.iloc[1::2, [raw.columns.get_loc(col) for col in columns[1::2]]] = np.nan
+        assert_parity(*fitted(model_type, sparse, training_data), transformer, raw)
+
+    def test_missing_categories(self, model_type, sparse, transformer, training_data, raw_test):
+        raw = raw_test.iloc[:20].copy()
+        for col in categorical_columns(transformer, raw):
+            raw.loc[raw.index[::3], col] = np.nan
+        assert_parity(*fitted(model_type, sparse, training_data), transformer, raw)
+
+    def test_unseen_categories(self, model_type, sparse, transformer, training_data, raw_test):
+        raw = raw_test.iloc[:20].copy()
+        for col in categorical_columns(transformer, raw):
+            raw.loc[raw.index[::2], col] = "never-seen"
+        assert_parity(*fitted(model_type, sparse, training_data), transformer, raw)
+
+
+@pytest.mark.parametrize("model_type", list(MAKERS))
+def test_sparse_infrequent_categories(model_type, transformer, training_data, raw_test):
+    """Rare training categories and unknown ones go to the infrequent column"""
+    model, compiled = fitted(model_type, True, training_data)
+    col_pipeline = model.named_steps["preprocess"]
+    encoder = col_pipeline.named_transformers_["CategoricalFeatures"].named_steps["encoder"]
+    columns = dict((name, columns) for name, _, columns in col_pipeline.transformers_)["CategoricalFeatures"]
+    rare_columns = {
+        col: rare for col, rare in zip(columns, encoder.infrequent_categories_)
+        if rare is not None
+    }
+    assert rare_columns, "no column has infrequent categories, SPARSE_PARAMS changed?"
+
+    raw = raw_test.iloc[:len(rare_columns) * 2].copy()
+    for i, (col, rare) in enumerate(rare_columns.items()):
+        if col == "MSSubClass":
+            # raw rows hold the code, engineer_features maps it to the label
+            codes = {label: code for code, label in transformer.sub_class.items()}
+            raw.loc[raw.index[2 * i], col] = codes[rare[0]]
+            raw.loc[raw.index[2 * i + 1], col] = -1
+        elif col in raw.columns:
+            raw.loc[raw.index[2 * i], col] = rare[0]
+            raw.loc[raw.index[2 * i + 1], col] = "never-seen"
+    assert_parity(model, compiled, transformer, raw)
+
+    # the compiled one-hot matrix equals the encoder output column by column
+    features = transformer.transform(raw)
+    expected = model.named_steps["preprocess"].transform(features)
+    expected = expected.toarray() if hasattr(expected, "toarray") else expected
+    records = json.loads(raw.reset_index().to_json(orient="records"))
+    data = transformer.transform_columns(record_columns(records, transformer.selected_columns_))
+    np.testing.assert_allclose(compiled.preprocessor.transform(data), expected, rtol=1e-9, atol=1e-9)